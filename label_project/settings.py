@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -132,3 +133,91 @@ LOGOUT_REDIRECT_URL = '/accounts/login/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Label rendering
+# Number of worker processes process_csv renders labels with (1 renders in the request process)
+LABEL_RENDER_WORKERS = 1
+
+# Seconds without progress after which run_label_worker treats a running job as abandoned
+LABEL_JOB_STALE_AFTER = 600
+
+# Rows committed per transaction (and per bulk statement) when ingesting a CSV
+LABEL_BULK_BATCH_SIZE = 500
+
+# Largest CSV file the upload form accepts, in bytes; ingestion memory doesn't depend on it
+LABEL_CSV_MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+
+# Memory limits for the cache of decoded, resized barcode bitmaps (per process)
+LABEL_BARCODE_CACHE_BYTES = 64 * 1024 * 1024
+LABEL_BARCODE_CACHE_ENTRIES = 2048
+
+# Draw a barcode from the row's GTIN when no EAN_<GTIN>.png was uploaded for it
+LABEL_SYNTHESIZE_BARCODES = True
+
+# Label PNG encoding: 'rgb' writes 24-bit PNGs. 'palette' opts in to indexed PNGs with the
+# template's fixed palette, about a third of the size, whose anti-aliased edges can differ
+# from 'rgb' by up to 1 level per channel. compress_level 0-9 trades encode time for size.
+LABEL_PNG_MODE = 'rgb'
+LABEL_PNG_COMPRESS_LEVEL = 6
+LABEL_PNG_OPTIMIZE = False
+
+# Page sizes of the upload history and the label list (a multiple of its 4 columns)
+LABEL_UPLOADS_PAGE_SIZE = 20
+LABEL_LIST_PAGE_SIZE = 48
+
+# Labels with identical content share one set of rendered files across uploads (labels.render_cache).
+# Files no label uses any more are deleted after this many seconds.
+LABEL_RENDER_CACHE_GC_GRACE = 3600
+
+# PDF export imposition: sheet ('a4', 'letter', 'a3' or 'roll'), and the page margin, gutter
+# between labels and bleed around each label in millimetres. Roll media is LABEL_PDF_ROLL_WIDTH
+# mm wide (None fits one label across) with a row of labels per page. The export form can
+# override the sheet and crop marks per download.
+LABEL_PDF_SHEET = 'letter'
+LABEL_PDF_MARGIN = 12.7
+LABEL_PDF_GUTTER = 0
+LABEL_PDF_BLEED = 0
+LABEL_PDF_CROP_MARKS = False
+LABEL_PDF_ROLL_WIDTH = None
+
+# Previews shown in the label list instead of the full image: width in pixels (half of
+# the 600px label by default), 'webp' or 'png', and the WebP quality
+LABEL_PREVIEW_WIDTH = 300
+LABEL_PREVIEW_FORMAT = 'webp'
+LABEL_PREVIEW_QUALITY = 80
+
+# CMYK print TIFFs (ZIP export). With an output ICC profile (e.g. a FOGRA39 or GRACoL .icc
+# file) the conversion is colour managed; without one Pillow's uncalibrated formula is used.
+# Compression: None, 'tiff_lzw' or 'tiff_adobe_deflate'. LABEL_RENDER_PRINT_TIFF renders each
+# label's TIFF with its PNG, so exports only copy files.
+LABEL_CMYK_ICC_PROFILE = os.environ.get('LABEL_CMYK_ICC_PROFILE') or None
+LABEL_CMYK_RENDERING_INTENT = 'relative_colorimetric'
+LABEL_TIFF_COMPRESSION = 'tiff_lzw'
+LABEL_RENDER_PRINT_TIFF = False
+
+# Labels rendered on demand at other DPIs and formats (/label/<id>/render/?dpi=&format=) are
+# cached on disk; the least recently used are deleted beyond this many bytes
+LABEL_RENDITION_CACHE_BYTES = 256 * 1024 * 1024
+
+# Most rows one request to the render API (/api/render/) renders; it saves nothing
+LABEL_RENDER_API_MAX_ROWS = 10000
+# Most label copies, the rows' Copies added up, one PDF from the render API places
+LABEL_RENDER_API_MAX_COPIES = 10000
+
+# Each process writes its pipeline metrics here; the staff-only /metrics/ view merges them
+LABEL_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'label_generator_metrics')
+
+# Pipeline logging. Set LABELS_LOG_LEVEL=DEBUG to log every CSV row.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{asctime} {levelname} {name}: {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'labels': {'handlers': ['console'], 'level': os.environ.get('LABELS_LOG_LEVEL', 'INFO')},
+    },
+}
@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import CSVUpload, ProductLabel, BarcodeImage
+from .models import Barcode, CSVUpload, ProductLabel, LabelJob
 
 
 admin.site.register(CSVUpload)
 admin.site.register(ProductLabel)
-admin.site.register(BarcodeImage)
+admin.site.register(Barcode)
+admin.site.register(LabelJob)
 # Register your models here.
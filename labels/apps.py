@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class LabelsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'labels'
+
+    def ready(self):
+        # Load the label fonts once at startup so the first render doesn't pay for it
+        from .fonts import font_registry
+        font_registry.warm()
@@ -0,0 +1,91 @@
+"""Barcode images shared by every upload, looked up by GTIN.
+
+Images are uploaded once as EAN_<GTIN>.<ext> and used by every later CSV
+with that GTIN. Files are stored under barcodes/<hash[:2]>/<hash>.<ext>
+by content, so uploading an image that is already stored writes nothing.
+"""
+import hashlib
+import os
+import re
+from django.db import transaction
+from .models import Barcode
+
+# EAN_<GTIN>.<ext>, e.g. EAN_8901234560006.png
+BARCODE_FILENAME = re.compile(r'^EAN_(\d{8,14})\.(png|jpe?g|gif)$', re.IGNORECASE)
+
+
+def parse_barcode_filename(filename):
+    """The GTIN in an EAN_<GTIN> image filename, or None."""
+    match = BARCODE_FILENAME.match(os.path.basename(filename))
+    return match.group(1) if match else None
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1024 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def content_path(digest, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{Barcode.image.field.upload_to}{digest[:2]}/{digest}{extension}'
+
+
+def _delete_if_unused(name, digest):
+    if name and not Barcode.objects.filter(content_hash=digest).exists():
+        Barcode.image.field.storage.delete(name)
+
+
+@transaction.atomic
+def store_barcode(gtin, file):
+    """Make file the barcode for gtin; return (barcode, changed).
+
+    An image identical to the one stored for the GTIN changes nothing. A new
+    one replaces it, and the old file is deleted after the commit if no GTIN
+    uses it any more.
+    """
+    digest = content_hash(file)
+    barcode = Barcode.objects.select_for_update().filter(gtin=gtin).first()
+    if barcode is not None and barcode.content_hash == digest:
+        return barcode, False
+
+    storage = Barcode.image.field.storage
+    name = content_path(digest, file.name)
+    if not storage.exists(name):
+        name = storage.save(name, file)
+
+    old_name, old_digest = (barcode.image.name, barcode.content_hash) if barcode else (None, None)
+    if barcode is None:
+        barcode = Barcode(gtin=gtin)
+    barcode.image.name = name
+    barcode.content_hash = digest
+    barcode.filename = os.path.basename(file.name)
+    barcode.save()
+    if old_digest:
+        # Only once the new row is committed: a rollback leaves the row on the old file
+        transaction.on_commit(lambda: _delete_if_unused(old_name, old_digest))
+    return barcode, True
+
+
+def barcode_paths(gtins):
+    """Map GTIN -> barcode image path for the given GTINs that have one, in one query."""
+    gtins = {gtin for gtin in gtins if gtin}
+    if not gtins:
+        return {}
+    storage = Barcode.image.field.storage
+    return {
+        gtin: storage.path(name)
+        for gtin, name in Barcode.objects.filter(gtin__in=gtins).values_list('gtin', 'image')
+    }
+
+
+def upload_barcode_paths(csv_upload):
+    """Map GTIN -> barcode image path for the GTINs of an upload's labels, in one query."""
+    storage = Barcode.image.field.storage
+    return {
+        gtin: storage.path(name)
+        for gtin, name in Barcode.objects.filter(gtin__in=csv_upload.labels.values('gtin')).values_list('gtin', 'image')
+    }
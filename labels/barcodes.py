@@ -0,0 +1,225 @@
+import os
+import threading
+from collections import OrderedDict
+import barcode
+from PIL import Image, ImageDraw
+from django.conf import settings
+from .fonts import get_font
+
+# python-barcode symbology for each GTIN length, and the quiet zone either
+# side of the symbol in modules
+GTIN_SYMBOLOGIES = {
+    8: ('ean8', 7, 7),
+    13: ('ean13', 11, 7),
+    14: ('itf', 20, 20),
+}
+
+
+def gtin_check_digit(digits):
+    """GS1 mod-10 check digit for the digits preceding it."""
+    total = sum(int(digit) * (3 if i % 2 == 0 else 1) for i, digit in enumerate(reversed(digits)))
+    return str((10 - total % 10) % 10)
+
+
+def is_valid_gtin(gtin):
+    """True for an EAN-8, EAN-13 or GTIN-14 with a correct check digit."""
+    return (
+        # isdigit() alone also accepts other scripts' digits and superscripts
+        gtin.isascii() and gtin.isdigit()
+        and len(gtin) in GTIN_SYMBOLOGIES
+        and gtin_check_digit(gtin[:-1]) == gtin[-1]
+    )
+
+
+class BarcodeSymbol:
+    """Bar pattern for a GTIN, drawn directly at the pixel size it is placed at."""
+
+    def __init__(self, gtin):
+        self.gtin = gtin
+        symbology, self.quiet_left, self.quiet_right = GTIN_SYMBOLOGIES[len(gtin)]
+        if symbology == 'itf':
+            self.modules = barcode.get_barcode_class('itf')(gtin).build()[0]
+        else:
+            # python-barcode recomputes the check digit from the leading digits
+            self.modules = barcode.get_barcode_class(symbology)(gtin[:-1]).build()[0]
+
+    def geometry(self, max_width, max_height):
+        """Lay the symbol out in a max_width x max_height box with whole-pixel modules.
+
+        Returns a dict with the symbol size, the bar spans and the human-readable
+        text placement, or None if the box is too small for a scannable symbol.
+        """
+        total_modules = self.quiet_left + len(self.modules) + self.quiet_right
+        module = max_width // total_modules
+        if module < 1:
+            return None
+
+        symbol_width = len(self.modules) * module
+        text_size = max(10, symbol_width // 14)
+        text_height = text_size + 2 * module
+        bar_height = min(max_height - text_height, symbol_width // 2)
+        if bar_height < 10 * module:
+            return None
+
+        bars = []
+        x = self.quiet_left * module
+        run_start = None
+        for i, bit in enumerate(self.modules + '0'):
+            if bit == '1' and run_start is None:
+                run_start = i
+            elif bit != '1' and run_start is not None:
+                bars.append((x + run_start * module, x + i * module))
+                run_start = None
+
+        return {
+            'width': total_modules * module,
+            'height': bar_height + text_height,
+            'bars': bars,
+            'bar_height': bar_height,
+            'text': self.gtin,
+            'text_size': text_size,
+            'text_y': bar_height + module,
+        }
+
+    def render(self, max_width, max_height):
+        """Return an RGB bitmap of the symbol fitted into the box, or None."""
+        geometry = self.geometry(max_width, max_height)
+        if geometry is None:
+            return None
+        bitmap = Image.new('RGB', (geometry['width'], geometry['height']), color='white')
+        draw = ImageDraw.Draw(bitmap)
+        for x0, x1 in geometry['bars']:
+            draw.rectangle([(x0, 0), (x1 - 1, geometry['bar_height'] - 1)], fill='black')
+        font = get_font('regular', geometry['text_size'])
+        text_width = draw.textlength(geometry['text'], font=font)
+        draw.text(((geometry['width'] - text_width) / 2, geometry['text_y']), geometry['text'],
+                  font=font, fill='black')
+        return bitmap
+
+
+def fit_barcode_size(barcode_width, barcode_height, max_width, max_height):
+    """Scale a barcode to max_width, shrinking to max_height if it's too tall; keeps the aspect ratio."""
+    ratio = barcode_width / barcode_height
+    final_width = max_width
+    final_height = int(final_width / ratio)
+
+    if final_height > max_height:
+        final_height = max_height
+        final_width = int(final_height * ratio)
+    return final_width, final_height
+
+
+class BarcodeBitmapCache:
+    """Bounded LRU cache of decoded, RGB-converted and resized barcode bitmaps.
+
+    Entries are keyed by (path, mtime, box width, box height), so replacing a
+    barcode file on disk naturally misses; barcodes synthesised from a GTIN
+    are keyed by (GTIN, box width, box height). Entries are evicted least recently used
+    first once the cache holds more than max_bytes of pixel data or
+    max_entries bitmaps. Cached images are shared and must not be modified.
+    """
+
+    def __init__(self, max_bytes=None, max_entries=None):
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            return getattr(settings, 'LABEL_BARCODE_CACHE_BYTES', 64 * 1024 * 1024)
+        return self._max_bytes
+
+    @property
+    def max_entries(self):
+        if self._max_entries is None:
+            return getattr(settings, 'LABEL_BARCODE_CACHE_ENTRIES', 2048)
+        return self._max_entries
+
+    def get(self, path, max_width, max_height):
+        """Return the barcode at path fitted into a max_width x max_height box, or None if it can't fit."""
+        key = (path, os.stat(path).st_mtime_ns, max_width, max_height)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        bitmap = self._load(path, max_width, max_height)
+        self._store(key, bitmap)
+        return bitmap
+
+    def get_synthesized(self, gtin, max_width, max_height):
+        """Return a barcode drawn from gtin for a max_width x max_height box, or None."""
+        key = ('gtin', gtin, max_width, max_height)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        bitmap = BarcodeSymbol(gtin).render(max_width, max_height)
+        self._store(key, bitmap)
+        return bitmap
+
+    def _load(self, path, max_width, max_height):
+        with Image.open(path) as barcode_img:
+            if barcode_img.mode != 'RGB':
+                barcode_img = barcode_img.convert('RGB')
+            final_width, final_height = fit_barcode_size(
+                barcode_img.width, barcode_img.height, max_width, max_height
+            )
+            if final_width <= 0 or final_height <= 0:
+                return None
+            return barcode_img.resize((final_width, final_height), Image.Resampling.LANCZOS)
+
+    @staticmethod
+    def _size_of(bitmap):
+        if bitmap is None:
+            return 0
+        return bitmap.width * bitmap.height * len(bitmap.getbands())
+
+    def _store(self, key, bitmap):
+        size = self._size_of(bitmap)
+        with self._lock:
+            if key in self._entries or size > self.max_bytes:
+                return
+            self._entries[key] = bitmap
+            self.bytes += size
+            while self._entries and (self.bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= self._size_of(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+barcode_cache = BarcodeBitmapCache()
+
+
+def synthesize_barcodes():
+    """Whether labels without an uploaded barcode image get one drawn from their GTIN."""
+    return getattr(settings, 'LABEL_SYNTHESIZE_BARCODES', True)
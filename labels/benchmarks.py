@@ -0,0 +1,311 @@
+"""Benchmarks for the label render, ingest and export paths, run by `manage.py bench_labels`."""
+import csv
+import io
+import math
+import os
+import platform
+import random
+import resource
+import tempfile
+import threading
+import time
+import django
+import PIL
+from django.core.files.base import ContentFile
+from .barcodes import barcode_cache, gtin_check_digit
+from .barcode_library import store_barcode, upload_barcode_paths
+from .models import CSVUpload
+from .render_cache import collect_unused_renders
+from .render_pool import render_workers
+from .utils import (
+    create_pdf_export, generate_label_image, get_label_skeleton, label_tiff_bytes,
+    process_csv, stream_zip_export, word_width, wrap_text,
+)
+
+STAGES = ('ingest', 'render', 'wrap_text', 'tiff', 'zip', 'pdf_raster', 'pdf_vector')
+
+CSV_HEADER = [
+    'ProductName', 'MRP', 'Quality', 'Size', 'Net Quantity', 'Product Code',
+    'Design / Color', 'Mth & Year of Mfg.', 'GTINs',
+]
+
+# Vocabulary for product names; a name is 1-14 words, so some wrap over several lines
+WORDS = (
+    'Cotton Towel Premium Soft XL Bath Hand Face Ultra Absorbent Jacquard Woven '
+    'Border Blue Green Floral Terry Organic Luxury Set Pack Striped Hotel Collection'
+).split()
+QUALITIES = ('Premium', '100% Cotton', 'Cotton Blend', 'Microfibre')
+SIZES = ('30 x 30 cm', '40 x 60 cm', '70 x 140 cm', '90 x 180 cm')
+COLOURS = ('Blue / Stripes', 'White', 'Grey / Check', 'Green Floral', 'Beige / Jacquard Border')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def synthetic_gtins(count):
+    """Return count valid EAN-13 GTINs."""
+    gtins = []
+    for i in range(count):
+        body = f'890{i:09d}'
+        gtins.append(body + gtin_check_digit(body))
+    return gtins
+
+
+def synthetic_rows(n, seed=0):
+    """Return (rows, gtins): n reproducible CSV rows and the GTINs they use."""
+    rnd = random.Random(seed)
+    gtins = synthetic_gtins(max(5, n // 20))
+    rows = []
+    for i in range(n):
+        rows.append({
+            'ProductName': ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 14))),
+            'MRP': f'Rs. {rnd.randint(99, 4999)}.00',
+            'Quality': rnd.choice(QUALITIES),
+            'Size': rnd.choice(SIZES),
+            'Net Quantity': f'{rnd.randint(1, 6)} N',
+            'Product Code': f'BENCH-{i:06d}',
+            'Design / Color': rnd.choice(COLOURS),
+            'Mth & Year of Mfg.': f'{rnd.choice(MONTHS)} {rnd.randint(2020, 2026)}',
+            'GTINs': rnd.choice(gtins),
+        })
+    return rows, gtins
+
+
+def barcode_png(gtin):
+    """PNG bytes of an EAN-13 barcode for gtin, like the ones users upload."""
+    import barcode
+    from barcode.writer import ImageWriter
+    buffer = io.BytesIO()
+    barcode.get('ean13', gtin[:12], writer=ImageWriter()).write(buffer)
+    return buffer.getvalue()
+
+
+def create_synthetic_upload(n, seed=0):
+    """Create a CSVUpload of n synthetic rows, with library barcode images for half of its GTINs.
+
+    The other GTINs have no image, so their barcodes are synthesised at render time.
+    """
+    rows, gtins = synthetic_rows(n, seed)
+    text = io.StringIO(newline='')
+    writer = csv.DictWriter(text, fieldnames=CSV_HEADER)
+    writer.writeheader()
+    writer.writerows(rows)
+
+    csv_upload = CSVUpload()
+    csv_upload.file.save(f'bench_{n}_{seed}.csv', ContentFile(text.getvalue().encode('utf-8')), save=True)
+    for gtin in gtins[::2]:
+        store_barcode(gtin, ContentFile(barcode_png(gtin), name=f'EAN_{gtin}.png'))
+    return csv_upload
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class PeakRSS:
+    """Track the peak RSS of this process while the block runs, by sampling it."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        if self.peak is None:
+            # No /proc: fall back to the lifetime peak, which is an upper bound
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            return self
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if hasattr(self, '_thread'):
+            self._thread.join()
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values (0 < fraction <= 1)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def stage_result(items, elapsed, latencies, output_bytes, peak_rss):
+    """Summarise one stage run: throughput, per-item latency in ms, output size and peak RSS."""
+    return {
+        'items': items,
+        'seconds': round(elapsed, 4),
+        'items_per_sec': round(items / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'output_bytes': output_bytes,
+        'peak_rss_bytes': peak_rss,
+    }
+
+
+def timed_items(items, work):
+    """Run work(item) for each item; return (elapsed, per-item latencies, total bytes returned)."""
+    latencies = []
+    output_bytes = 0
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        output = work(item)
+        latencies.append(time.perf_counter() - item_start)
+        if output is not None:
+            output_bytes += len(output)
+    return time.perf_counter() - start, latencies, output_bytes
+
+
+def bench_ingest(csv_upload, workers=None):
+    # process_csv reports progress per batch, so each label's latency is its batch's share
+    latencies = []
+    last = [time.perf_counter(), 0]
+
+    def progress(processed_rows, total_rows):
+        now = time.perf_counter()
+        done = processed_rows - last[1]
+        if done > 0:
+            latencies.extend([(now - last[0]) / done] * done)
+        last[:] = [now, processed_rows]
+
+    start = time.perf_counter()
+    process_csv(csv_upload, workers=workers, progress=progress)
+    elapsed = time.perf_counter() - start
+    output_bytes = sum(
+        label.image.size for label in csv_upload.labels.exclude(image='').only('image') if label.image
+    )
+    return elapsed, latencies, output_bytes
+
+
+def bench_render(csv_upload):
+    barcode_map = upload_barcode_paths(csv_upload)
+    barcode_cache.clear()
+
+    def render(label):
+        barcode_path = barcode_map.get(label.gtin)
+        return generate_label_image(label, barcode_path=barcode_path).read()
+
+    return timed_items(csv_upload.labels.all(), render)
+
+
+def bench_wrap_text(csv_upload):
+    word_width.cache_clear()
+    labels = list(csv_upload.labels.all())
+    skeleton = get_label_skeleton(labels[0].manufacturer) if labels else None
+
+    def wrap(label):
+        wrap_text(label.product_name, skeleton.font_normal, skeleton.max_value_width)
+
+    return timed_items(labels, wrap)
+
+
+def bench_tiff(csv_upload):
+    return timed_items(csv_upload.labels.exclude(image=''), label_tiff_bytes)
+
+
+def bench_zip(csv_upload):
+    start = time.perf_counter()
+    output_bytes = sum(len(chunk) for chunk in stream_zip_export(csv_upload))
+    return time.perf_counter() - start, [], output_bytes
+
+
+def bench_pdf(csv_upload, mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, 'bench.pdf')
+        start = time.perf_counter()
+        create_pdf_export(csv_upload, pdf_path=pdf_path, mode=mode)
+        elapsed = time.perf_counter() - start
+        return elapsed, [], os.path.getsize(pdf_path)
+
+
+def run_stage(stage, csv_upload, workers=None):
+    benches = {
+        'ingest': lambda: bench_ingest(csv_upload, workers),
+        'render': lambda: bench_render(csv_upload),
+        'wrap_text': lambda: bench_wrap_text(csv_upload),
+        'tiff': lambda: bench_tiff(csv_upload),
+        'zip': lambda: bench_zip(csv_upload),
+        'pdf_raster': lambda: bench_pdf(csv_upload, 'raster'),
+        'pdf_vector': lambda: bench_pdf(csv_upload, 'vector'),
+    }
+    with PeakRSS() as rss:
+        elapsed, latencies, output_bytes = benches[stage]()
+    return stage_result(csv_upload.labels.count(), elapsed, latencies, output_bytes, rss.peak)
+
+
+def run_benchmarks(sizes, stages=STAGES, seed=0, workers=None, report=None):
+    """Benchmark every stage at every size; return the results as a JSON-serialisable dict.
+
+    Ingest always runs first for a size, since every other stage reads the
+    labels it creates, and always starts from an empty render cache. report(stage, rows, result) is called after each run.
+    """
+    workers = render_workers() if workers is None else workers
+    results = {}
+    for rows in sizes:
+        csv_upload = create_synthetic_upload(rows, seed)
+        for stage in ('ingest',) + tuple(s for s in stages if s != 'ingest'):
+            result = run_stage(stage, csv_upload, workers)
+            if stage in stages:
+                results.setdefault(stage, {})[str(rows)] = result
+                if report:
+                    report(stage, rows, result)
+        csv_upload.delete()
+        # Sizes share their leading rows; don't let the next ingest reuse these renders
+        collect_unused_renders(grace_seconds=0)
+
+    return {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'workers': workers,
+            'seed': seed,
+            'sizes': list(sizes),
+        },
+        'results': results,
+    }
+
+
+def compare_results(results, baseline, threshold=0.1):
+    """Compare a run with a baseline; return [(stage, rows, metric, old, new, change, regressed)].
+
+    change is the relative change of the metric, and regressed is True when
+    the metric got worse by more than threshold. Throughput should go up and
+    latency, memory and output size down.
+    """
+    higher_is_better = {'items_per_sec': True, 'p50_ms': False, 'p99_ms': False,
+                        'peak_rss_bytes': False, 'output_bytes': False}
+    rows = []
+    for stage, by_size in results['results'].items():
+        for size, result in by_size.items():
+            old_result = baseline.get('results', {}).get(stage, {}).get(size)
+            if not old_result:
+                continue
+            for metric, higher in higher_is_better.items():
+                old, new = old_result.get(metric), result.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                regressed = -change > threshold if higher else change > threshold
+                rows.append((stage, int(size), metric, old, new, change, regressed))
+    return rows
@@ -0,0 +1,232 @@
+"""Labels rendered straight from request rows, without saving anything.
+
+The render API takes rows with the CSV's columns, as a CSV body, an uploaded
+CSV file or JSON, and returns their labels as a ZIP of images or as a PDF.
+Labels are unsaved ProductLabel objects: nothing is written to the database
+or to MEDIA_ROOT, and the only queries look up barcodes in the shared
+library, a batch of rows at a time.
+
+ZIPs are streamed a label at a time as they are rendered, and CSV bodies are
+read as they arrive, so memory stays around one batch of rows however large
+the payload. A PDF can only be sent once reportlab has finished it, so it
+is written to a temporary file first, and the Copies of its rows may add up
+to at most LABEL_RENDER_API_MAX_COPIES placements.
+"""
+import codecs
+import hashlib
+import io
+import json
+import logging
+import tempfile
+import zipfile
+from django.conf import settings
+from reportlab.pdfgen import canvas
+from .barcode_library import barcode_paths
+from .csv_reader import CSVRowError, CSVRowReader
+from .imposition import RasterLabelForms, VectorLabelForms, place_form
+from .metrics import EXPORT_BYTES, timed
+from .utils import ZipStream, filename_part, generate_label_image, label_fingerprint, label_from_row, parse_copies, render_label_files
+
+logger = logging.getLogger(__name__)
+
+# Contents of ZIP responses: the label PNGs, or the CMYK print TIFFs of exports
+ZIP_FORMATS = ('png', 'tiff')
+
+# Rows read, looked up and rendered together
+BATCH_SIZE = 100
+
+ERRORS_FILENAME = 'errors.txt'
+
+
+def max_rows():
+    return int(getattr(settings, 'LABEL_RENDER_API_MAX_ROWS', 10000))
+
+
+def max_copies():
+    return int(getattr(settings, 'LABEL_RENDER_API_MAX_COPIES', 10000))
+
+
+class RenderRequestError(ValueError):
+    """A render request whose rows can't be read at all."""
+
+
+class RequestBody(io.RawIOBase):
+    """A request body as a raw binary stream, read as it arrives."""
+
+    def __init__(self, request):
+        super().__init__()
+        self._request = request
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._request.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def json_rows(body):
+    """(row_number, row, error) for a JSON body: a list of rows, or {"rows": [...]}.
+
+    The body is parsed and checked straight away, so a bad one is reported
+    before a response starts.
+    """
+    try:
+        data = json.loads(body)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise RenderRequestError(f"Body isn't valid JSON: {e}")
+    rows = data.get('rows') if isinstance(data, dict) else data
+    if not isinstance(rows, list):
+        raise RenderRequestError('Expected a list of rows, or an object with a "rows" list.')
+    if len(rows) > max_rows():
+        raise RenderRequestError(f"At most {max_rows()} rows can be rendered at once, got {len(rows)}.")
+    return _json_row_items(rows)
+
+
+def _json_row_items(rows):
+    for row_number, row in enumerate(rows):
+        if not isinstance(row, dict):
+            yield row_number, None, CSVRowError(f"Row {row_number + 1}: expected an object of column values")
+            continue
+        yield row_number, {str(key): '' if value is None else str(value) for key, value in row.items()}, None
+
+
+def request_rows(request):
+    """(row_number, row, error) for the rows of a render request, read lazily.
+
+    JSON bodies are parsed whole, so their size is bounded by
+    DATA_UPLOAD_MAX_MEMORY_SIZE. CSV bodies are decoded as they are read,
+    with the charset of their Content-Type (UTF-8 by default); uploaded CSV
+    files have their encoding detected like uploads do.
+    """
+    if request.content_type == 'application/json':
+        return json_rows(request.body)
+    if request.content_type == 'multipart/form-data':
+        if 'file' not in request.FILES:
+            raise RenderRequestError('Upload the CSV as the "file" field.')
+        return CSVRowReader(request.FILES['file'].file)
+    if request.content_type in ('text/csv', 'text/plain'):
+        encoding = request.content_params.get('charset', 'utf-8')
+        try:
+            # utf-8-sig also drops a BOM
+            encoding = 'utf-8-sig' if codecs.lookup(encoding).name == 'utf-8' else encoding
+        except LookupError:
+            raise RenderRequestError(f"Unknown charset {encoding!r}.")
+        return CSVRowReader(io.BufferedReader(RequestBody(request)), encoding=encoding)
+    raise RenderRequestError('Send rows as application/json, text/csv or a multipart "file" upload.')
+
+
+def request_labels(rows, errors):
+    """Yield (row_number, label, barcode path) for rows, appending rows that can't be used to errors.
+
+    Labels are unsaved; barcodes are looked up a batch of rows at a time.
+    """
+    limit = max_rows()
+    batch = []
+    for row_number, row, error in rows:
+        if row_number >= limit:
+            errors.append(f"Only the first {limit} rows are rendered, the rest were skipped")
+            break
+        if error is None:
+            try:
+                copies = parse_copies(row)
+            except ValueError as e:
+                error = f"Row {row_number + 1}: {e}"
+        if error is not None:
+            errors.append(str(error))
+            continue
+        batch.append(label_from_row(row, row_number=row_number, copies=copies))
+        if len(batch) >= BATCH_SIZE:
+            yield from _with_barcodes(batch)
+            batch = []
+    yield from _with_barcodes(batch)
+
+
+def _with_barcodes(labels):
+    barcode_map = barcode_paths(label.gtin for label in labels)
+    for label in labels:
+        yield label.row_number, label, barcode_map.get(label.gtin)
+
+
+def label_filename(label, extension):
+    # Product codes come from the request, so they're cleaned before naming archive entries
+    return f'label_{label.row_number + 1:05d}_{filename_part(label.product_code)}.{extension}'
+
+
+def stream_label_zip(rows, fmt='png'):
+    """Yield a ZIP of the labels for rows, one label at a time as each is rendered.
+
+    Rows that couldn't be rendered are listed in errors.txt at the end.
+    """
+    errors = []
+    stream = ZipStream()
+    size = 0
+    with zipfile.ZipFile(stream, 'w') as zipf:
+        for _, label, barcode_path in request_labels(rows, errors):
+            if fmt == 'tiff':
+                data = render_label_files(label, barcode_path, preview=False, print_tiff=True).print_image
+            else:
+                data = generate_label_image(label, barcode_path).read()
+            zipf.writestr(label_filename(label, 'tif' if fmt == 'tiff' else 'png'), data)
+            chunk = stream.pop()
+            size += len(chunk)
+            yield chunk
+        if errors:
+            zipf.writestr(ERRORS_FILENAME, ''.join(f'{error}\n' for error in errors))
+    # Central directory
+    chunk = stream.pop()
+    EXPORT_BYTES.inc(size + len(chunk), kind='api_zip')
+    yield chunk
+
+
+def build_label_pdf(rows, imposition, mode='raster'):
+    """Impose the labels for rows into a PDF; return (temporary file, errors).
+
+    Each row is placed its Copies times, and each distinct label embedded
+    once, as in PDF exports. The file is rewound and deleted when closed.
+    Raises RenderRequestError once the rows ask for more than max_copies()
+    copies in all.
+    """
+    errors = []
+    limit = max_copies()
+    output = tempfile.TemporaryFile()
+    c = canvas.Canvas(output, pagesize=imposition.page_size)
+    label_width, label_height = imposition.label_width, imposition.label_height
+    if mode == 'vector':
+        from .vector_pdf import VectorLabelRenderer
+        renderer = VectorLabelRenderer(c)
+        forms = VectorLabelForms(renderer, label_width, label_height)
+    else:
+        forms = RasterLabelForms(c, label_width, label_height)
+
+    def placements():
+        placed = 0
+        for row_number, label, barcode_path in request_labels(rows, errors):
+            if label.copies < 1:
+                continue
+            placed += label.copies
+            if placed > limit:
+                raise RenderRequestError(f"At most {limit} copies can be placed in one PDF, "
+                                         f"row {row_number + 1} takes the rows' Copies past that.")
+            if mode == 'vector':
+                if barcode_path:
+                    renderer.barcode_map[label.gtin] = barcode_path
+                label.fingerprint = label_fingerprint(label, barcode_path)
+                name = forms.form(label)
+            else:
+                data = generate_label_image(label, barcode_path).read()
+                name = forms.image_form(hashlib.sha256(data).hexdigest(), io.BytesIO(data), f'row {row_number + 1}')
+            if name:
+                yield place_form(name), label.copies
+
+    with timed(f'api_pdf_{mode}'):
+        try:
+            imposition.impose(c, placements())
+        except RenderRequestError:
+            output.close()
+            raise
+        c.save()
+    EXPORT_BYTES.inc(output.tell(), kind=f'api_pdf_{mode}')
+    output.seek(0)
+    return output, errors
@@ -0,0 +1,138 @@
+import hashlib
+import io
+import logging
+import os
+from functools import lru_cache
+from PIL import ImageCms
+from django.conf import settings
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+RENDERING_INTENTS = {
+    'perceptual': ImageCms.Intent.PERCEPTUAL,
+    'relative_colorimetric': ImageCms.Intent.RELATIVE_COLORIMETRIC,
+    'saturation': ImageCms.Intent.SATURATION,
+    'absolute_colorimetric': ImageCms.Intent.ABSOLUTE_COLORIMETRIC,
+}
+
+# Pillow TIFF compression names accepted for LABEL_TIFF_COMPRESSION (None writes raw TIFFs)
+TIFF_COMPRESSIONS = (None, 'tiff_lzw', 'tiff_adobe_deflate')
+
+PRINT_DPI = 300
+
+
+def cmyk_profile_path():
+    """Path of the CMYK output ICC profile (LABEL_CMYK_ICC_PROFILE), or None."""
+    return getattr(settings, 'LABEL_CMYK_ICC_PROFILE', None) or None
+
+
+def rendering_intent():
+    return getattr(settings, 'LABEL_CMYK_RENDERING_INTENT', 'relative_colorimetric')
+
+
+def tiff_compression():
+    compression = getattr(settings, 'LABEL_TIFF_COMPRESSION', None)
+    return compression if compression in TIFF_COMPRESSIONS else None
+
+
+@lru_cache(maxsize=4)
+def _build_transform(profile_path, mtime_ns, intent):
+    # mtime_ns is only part of the key, so replacing the profile file rebuilds the transform
+    return ImageCms.buildTransform(
+        ImageCms.createProfile('sRGB'), ImageCms.getOpenProfile(profile_path), 'RGB', 'CMYK',
+        renderingIntent=RENDERING_INTENTS[intent], flags=ImageCms.Flags.BLACKPOINTCOMPENSATION,
+    )
+
+
+@lru_cache(maxsize=None)
+def _report_fallback(reason):
+    # Once per process and reason, not once per label
+    logger.warning("Converting labels to CMYK without colour management: %s", reason)
+
+
+def cmyk_transform():
+    """The sRGB to CMYK transform for the configured profile, built once per process, or None."""
+    profile_path = cmyk_profile_path()
+    if profile_path is None:
+        return None
+    try:
+        return _build_transform(profile_path, os.stat(profile_path).st_mtime_ns, rendering_intent())
+    except (OSError, ImageCms.PyCMSError, KeyError) as e:
+        _report_fallback(f"can't use profile {profile_path}: {e}")
+        return None
+
+
+def to_cmyk(img):
+    """Convert a rendered label to CMYK, colour managed when a profile is configured."""
+    if img.mode != 'RGB':
+        # Palette labels go through RGB so each entry maps to its exact colour
+        img = img.convert('RGB')
+    transform = cmyk_transform()
+    if transform is None:
+        return img.convert('CMYK')
+    return ImageCms.applyTransform(img, transform)
+
+
+def print_tiff_bytes(img, dpi=PRINT_DPI):
+    """Encode a rendered label as the CMYK TIFF used for print exports.
+
+    Colour managed TIFFs embed the output profile, so RIPs interpret the CMYK
+    values for the press they were separated for.
+    """
+    with timed('tiff_encode'):
+        cmyk_img = to_cmyk(img)
+        options = {}
+        profile = output_profile()
+        if profile is not None:
+            options['icc_profile'] = profile[0]
+        output = io.BytesIO()
+        cmyk_img.save(output, format='TIFF', dpi=(dpi, dpi), compression=tiff_compression(), **options)
+    return output.getvalue()
+
+
+@lru_cache(maxsize=4)
+def _profile_file(profile_path, mtime_ns):
+    with open(profile_path, 'rb') as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def output_profile():
+    """(bytes, sha256) of the ICC profile labels are converted with, or None without colour management."""
+    profile_path = cmyk_profile_path()
+    if not profile_path or cmyk_transform() is None:
+        return None
+    try:
+        return _profile_file(profile_path, os.stat(profile_path).st_mtime_ns)
+    except OSError as e:
+        _report_fallback(f"can't read profile {profile_path}: {e}")
+        return None
+
+
+def print_options():
+    """Everything that changes print TIFF bytes, for export cache keys and stored print images."""
+    profile = output_profile()
+    options = {
+        'format': 'tiff',
+        'colorspace': 'CMYK',
+        'dpi': PRINT_DPI,
+        'icc_profile': profile[1] if profile else None,
+        'intent': rendering_intent() if profile else None,
+        'compression': tiff_compression(),
+    }
+    if profile:
+        # TIFFs from before the profile was embedded are replaced
+        options['embedded_profile'] = True
+    return options
+
+
+def print_options_key():
+    """Short digest of print_options(), stored with render-time print TIFFs."""
+    options = print_options()
+    return hashlib.sha256(repr(sorted(options.items())).encode()).hexdigest()[:16]
+
+
+def render_print_tiff():
+    """True if a print TIFF is rendered alongside each label PNG (LABEL_RENDER_PRINT_TIFF)."""
+    return bool(getattr(settings, 'LABEL_RENDER_PRINT_TIFF', False))
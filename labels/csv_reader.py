@@ -0,0 +1,120 @@
+import codecs
+import csv
+import io
+import logging
+import os
+from charset_normalizer import from_bytes
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Encodings spreadsheet exports of our CSVs come in; charset-normalizer picks
+# between them, which avoids it mistaking cp1252 for another Latin code page
+PREFERRED_ENCODINGS = ['utf_8', 'utf_16', 'cp1252']
+
+# At most this many malformed rows are kept on the upload for display
+MAX_ROW_ERRORS = 1000
+
+
+def _cp1252_fallback(error):
+    """Decode bytes that aren't valid UTF-8 as cp1252, for UTF-8 files with stray Excel bytes."""
+    bad_bytes = error.object[error.start:error.end]
+    return bad_bytes.decode('cp1252', errors='replace'), error.end
+
+
+codecs.register_error('labels.cp1252_fallback', _cp1252_fallback)
+
+
+def sample_size():
+    return getattr(settings, 'LABEL_CSV_ENCODING_SAMPLE_BYTES', 64 * 1024)
+
+
+def detect_encoding(sample):
+    """Return (encoding, errors) to decode a CSV whose leading bytes are sample."""
+    # Don't end the sample part-way through a multi-byte character
+    if len(sample) >= sample_size() and b'\n' in sample:
+        sample = sample[:sample.rindex(b'\n') + 1]
+
+    best = from_bytes(sample, cp_isolation=PREFERRED_ENCODINGS).best()
+    if best is None or best.encoding in ('ascii', 'utf_8'):
+        # Plain ASCII is most likely UTF-8, and a file that is neither clean UTF-8
+        # nor cp1252 is usually UTF-8 with stray bytes from Excel, which are decoded
+        # as cp1252. utf-8-sig also drops an Excel BOM.
+        return 'utf-8-sig', 'labels.cp1252_fallback'
+    return best.encoding, 'replace'
+
+
+class CSVRowError(Exception):
+    """A CSV row that can't be turned into a label."""
+
+
+class CSVRowReader:
+    """Read a CSV file in a single pass, yielding (row_number, row, error).
+
+    The encoding is detected from a leading sample of the open file, which is
+    then rewound and decoded as a stream; it is available as `encoding` once
+    iteration has started. row_number counts data rows from 0. Rows that
+    can't be used are yielded with row None and a CSVRowError describing the
+    problem, so one bad line doesn't abort the whole upload.
+
+    file_path may also be an open binary file. One that can't be rewound,
+    e.g. a request body, must be given its encoding, which skips detection.
+    """
+
+    def __init__(self, file_path, encoding=None):
+        self.file_path = file_path
+        self.encoding = encoding
+        self._raw = None
+
+    def estimate_rows(self, rows_read):
+        """Estimate the number of rows in the file from how far rows_read rows got into it."""
+        if self._raw is None or self._raw.closed:
+            return rows_read
+        bytes_read = self._raw.tell()
+        if not bytes_read:
+            return rows_read
+        return max(rows_read, round(rows_read * os.fstat(self._raw.fileno()).st_size / bytes_read))
+
+    def __iter__(self):
+        if hasattr(self.file_path, 'read'):
+            yield from self._read(self.file_path, getattr(self.file_path, 'name', None) or 'stream')
+        else:
+            with open(self.file_path, mode='rb') as raw:
+                yield from self._read(raw, os.path.basename(self.file_path))
+
+    def _read(self, raw, name):
+        self._raw = raw
+        if self.encoding is None:
+            self.encoding, errors = detect_encoding(raw.read(sample_size()))
+            raw.seek(0)
+        else:
+            errors = 'replace'
+        logger.info("Reading %s as %s", name, self.encoding)
+        text = io.TextIOWrapper(raw, encoding=self.encoding, errors=errors, newline='')
+        reader = csv.DictReader(text, restval='')
+
+        row_number = 0
+        try:
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error as e:
+                    yield row_number, None, CSVRowError(f"Line {reader.line_num}: {e}")
+                    row_number += 1
+                    continue
+
+                yield row_number, *self._check(reader.line_num, row)
+                row_number += 1
+        finally:
+            # Leave the file to whoever opened it; TextIOWrapper closes it when collected
+            text.detach()
+
+    def _check(self, line_num, row):
+        """Return (row, None) for a usable row, otherwise (None, CSVRowError)."""
+        if None in row:
+            return None, CSVRowError(f"Line {line_num}: {len(row[None])} more value(s) than there are columns")
+        if any('\ufffd' in value for value in row.values() if value):
+            return None, CSVRowError(f"Line {line_num}: contains characters that aren't valid {self.encoding}")
+        return row, None
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import shutil
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from .models import ProductLabel
+from .render_pool import RENDER_FIELDS
+from .storage import atomic_path
+
+# Exports are stored under MEDIA_ROOT/<EXPORT_CACHE_DIR>/<upload id>/<key>.<ext>
+EXPORT_CACHE_DIR = 'exports'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def label_image_hashes(csv_upload):
+    """Return [(label id, product code, copies, image hash)] for the upload's labels that have an image.
+
+    Labels rendered before image hashes were stored get theirs computed and saved here.
+    """
+    rows = []
+    missing = []
+    labels = csv_upload.labels.exclude(image='').exclude(image__isnull=True)
+    for label in labels.only('id', 'product_code', 'copies', 'image', 'image_hash').order_by('id').iterator():
+        if not label.image_hash:
+            if not os.path.exists(label.image.path):
+                continue
+            label.image_hash = file_sha256(label.image.path)
+            missing.append(label)
+        rows.append((label.id, label.product_code, label.copies, label.image_hash))
+    if missing:
+        ProductLabel.objects.bulk_update(missing, ['image_hash'], batch_size=500)
+    return rows
+
+
+def label_contents(csv_upload):
+    """Yield (label id, copies, fingerprint, *rendered fields) for each of the upload's labels, with an image or not."""
+    fields = ('id', 'copies', 'fingerprint', *RENDER_FIELDS)
+    yield from csv_upload.labels.order_by('id').values_list(*fields).iterator()
+
+
+def export_cache_key(csv_upload, kind, options=None, every_label=False):
+    """Key an export by its kind, its options and the content (and copies) of every label image.
+
+    Exports drawn from the labels' fields rather than their images (vector
+    PDFs) pass every_label, which keys them by every label's fields and
+    fingerprint instead, including labels that have no image.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'kind': kind, 'options': options or {}}, sort_keys=True).encode())
+    if every_label:
+        for values in label_contents(csv_upload):
+            digest.update(('\n' + json.dumps(values)).encode())
+        return digest.hexdigest()
+    for label_id, product_code, copies, image_hash in label_image_hashes(csv_upload):
+        digest.update(f'\n{label_id}\t{product_code}\t{copies}\t{image_hash}'.encode())
+    return digest.hexdigest()
+
+
+def export_cache_dir(csv_upload):
+    return os.path.join(settings.MEDIA_ROOT, EXPORT_CACHE_DIR, str(csv_upload.id))
+
+
+def export_cache_path(csv_upload, key, extension):
+    return os.path.join(export_cache_dir(csv_upload), f'{key}.{extension}')
+
+
+def invalidate_export_cache(csv_upload):
+    """Drop every cached export of the upload, e.g. before its labels are regenerated."""
+    shutil.rmtree(export_cache_dir(csv_upload), ignore_errors=True)
+
+
+def build_cached_export(path, build):
+    """Run build(output_path) into a partial file and move it into place when complete."""
+    with atomic_path(path) as partial:
+        build(partial)
+    return path
+
+
+def tee_to_cache(chunks, path):
+    """Pass chunks through while also writing them to path.
+
+    The cached file only appears once the whole stream has been produced, so
+    an interrupted download never leaves a truncated export behind.
+    """
+    with atomic_path(path) as partial, open(partial, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+
+
+def set_validators(response, key, last_modified=None):
+    """Add ETag/Last-Modified headers and ask caches to revalidate before reuse."""
+    response['ETag'] = quote_etag(key)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def cached_export_response(request, path, key, content_type, filename):
+    """Serve a cached export, answering conditional requests with 304 Not Modified."""
+    last_modified = int(os.path.getmtime(path))
+    response = get_conditional_response(request, etag=quote_etag(key), last_modified=last_modified)
+    if response is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return set_validators(response, key, last_modified)
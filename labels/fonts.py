@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import os
+import threading
+from PIL import ImageFont
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Font files for each face, relative to the Myriad Pro font directory
+FONT_FACES = {
+    'regular': 'MYRIADPRO-REGULAR.OTF',
+    'bold': 'MYRIADPRO-BOLD.OTF',
+}
+
+
+def label_font_sizes(dpi):
+    """Return (body, make_in_india) pixel font sizes for a label rendered at dpi."""
+    target_point_size = 6.5
+    visual_reduction_factor = 0.9
+    calculated_pixel_size = target_point_size * dpi / 72
+    font_size = int(calculated_pixel_size * visual_reduction_factor)
+    if font_size < 10:
+        font_size = 10
+    return font_size, int(font_size * 1.2)
+
+
+class FontRegistry:
+    """Process-wide cache of loaded fonts keyed by (face, pixel size)."""
+
+    def __init__(self, font_dir=None):
+        self._font_dir = font_dir
+        self._fonts = {}
+        self._failed_faces = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._fingerprint = None
+
+    @property
+    def font_dir(self):
+        if self._font_dir is None:
+            self._font_dir = os.path.join(settings.BASE_DIR, 'static', 'style', 'fonts', 'myriad-pro')
+        return self._font_dir
+
+    def font_path(self, face):
+        return os.path.join(self.font_dir, FONT_FACES[face])
+
+    def get(self, face, size):
+        """Return the font for face at size, loading it on first use."""
+        key = (face, size)
+        font = self._fonts.get(key)
+        if font is not None:
+            self.hits += 1
+            return font
+
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self.hits += 1
+                return font
+            self.misses += 1
+            font = self._load(face, size)
+            self._fonts[key] = font
+            return font
+
+    def _load(self, face, size):
+        if face not in self._failed_faces:
+            try:
+                return ImageFont.truetype(self.font_path(face), size)
+            except Exception as e:
+                # Only report once per face, every later size goes straight to the fallback
+                logger.warning("Font load failed for '%s', using default font: %s", face, e)
+                self._failed_faces.add(face)
+        return ImageFont.load_default()
+
+    def warm(self, dpi=300):
+        """Preload every face at the sizes a label rendered at dpi uses."""
+        font_size, mii_font_size = label_font_sizes(dpi)
+        for face in FONT_FACES:
+            self.get(face, font_size)
+        self.get('bold', mii_font_size)
+
+    def fingerprint(self):
+        """SHA-256 over the font files, so label fingerprints change when a font is replaced."""
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for face in sorted(FONT_FACES):
+                digest.update(face.encode())
+                try:
+                    with open(self.font_path(face), 'rb') as f:
+                        digest.update(f.read())
+                except OSError:
+                    digest.update(b'default')
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'loaded': len(self._fonts),
+            'failed_faces': sorted(self._failed_faces),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+            self._failed_faces.clear()
+            self._fingerprint = None
+            self.hits = 0
+            self.misses = 0
+
+
+font_registry = FontRegistry()
+
+
+def get_font(face, size):
+    """Shortcut for font_registry.get()."""
+    return font_registry.get(face, size)
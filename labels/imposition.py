@@ -0,0 +1,256 @@
+"""Imposition of labels onto PDF sheets.
+
+Labels are laid out in a grid on A4, letter or A3 sheets, or one row per page
+on continuous roll media, with a gutter between labels, bleed around each one
+and optional crop marks at the trim corners. A row's `copies` decides how
+many times its label is placed.
+
+Every distinct label is drawn once into a PDF form XObject and each copy only
+references it, so printing a label 50 times adds 50 short placement
+operators to the page streams rather than 50 copies of the image.
+"""
+import logging
+from reportlab.lib.pagesizes import A3, A4, letter
+from reportlab.lib.units import inch, mm
+from reportlab.lib.utils import ImageReader
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SHEETS = {
+    'a4': A4,
+    'letter': letter,
+    'a3': A3,
+    # Continuous media: as wide as LABEL_PDF_ROLL_WIDTH, one row of labels per page
+    'roll': None,
+}
+
+# Trimmed label size, in points (2 x 3 inches)
+LABEL_SIZE = (2 * inch, 3 * inch)
+
+# Crop marks start this far outside the bleed and are this long, in points
+CROP_MARK_OFFSET = 3
+CROP_MARK_LENGTH = 9
+CROP_MARK_WIDTH = 0.25
+
+
+def _length(value, default):
+    """A length in millimetres from a setting or query parameter, as points; default for invalid values."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value * mm if 0 <= value <= 1000 else default
+
+
+def _flag(value, default):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+class Imposition:
+    """Where each label goes on which page, for one sheet and spacing.
+
+    Lengths are in points. Labels fill pages left to right and top to bottom,
+    starting in the top left corner inside the margin.
+    """
+
+    def __init__(self, sheet='letter', margin=0.5 * inch, gutter=0, bleed=0, crop_marks=False, roll_width=None,
+                 label_size=LABEL_SIZE):
+        if sheet not in SHEETS:
+            raise ValueError(f"Unknown sheet {sheet!r}, expected one of {', '.join(SHEETS)}")
+        self.sheet = sheet
+        self.label_width, self.label_height = label_size
+        self.bleed = bleed
+        self.crop_marks = crop_marks
+        # Crop marks are drawn in the margin and gutters, so leave them room
+        mark_space = CROP_MARK_OFFSET + CROP_MARK_LENGTH if crop_marks else 0
+        self.margin = max(margin, mark_space)
+        self.gutter = max(gutter, 2 * mark_space)
+
+        cell_width, cell_height = self.cell_size
+        if sheet == 'roll':
+            width = roll_width or cell_width + 2 * self.margin
+            self.page_size = (width, cell_height + 2 * self.margin)
+        else:
+            self.page_size = SHEETS[sheet]
+        self.columns = self._fit(self.page_size[0], cell_width)
+        self.rows = 1 if sheet == 'roll' else self._fit(self.page_size[1], cell_height)
+        if not self.columns or not self.rows:
+            raise ValueError(f"A {self.label_width / mm:.0f} x {self.label_height / mm:.0f} mm label "
+                             f"doesn't fit on a {sheet} sheet with these margins")
+
+    @property
+    def cell_size(self):
+        """Size of a label with its bleed."""
+        return self.label_width + 2 * self.bleed, self.label_height + 2 * self.bleed
+
+    @property
+    def per_page(self):
+        return self.columns * self.rows
+
+    def _fit(self, page_length, cell_length):
+        return max(0, int((page_length - 2 * self.margin + self.gutter) // (cell_length + self.gutter)))
+
+    def options(self):
+        """Everything that changes the layout, for export cache keys."""
+        return {
+            'sheet': self.sheet,
+            'page_size': [round(length, 3) for length in self.page_size],
+            'margin': round(self.margin, 3),
+            'gutter': round(self.gutter, 3),
+            'bleed': round(self.bleed, 3),
+            'crop_marks': self.crop_marks,
+        }
+
+    def position(self, index):
+        """(page, x, y) of the trim box of the index-th placed label, x and y from the page's bottom left."""
+        page, slot = divmod(index, self.per_page)
+        row, column = divmod(slot, self.columns)
+        cell_width, cell_height = self.cell_size
+        x = self.margin + column * (cell_width + self.gutter) + self.bleed
+        top = self.page_size[1] - self.margin - row * (cell_height + self.gutter)
+        return page, x, top - self.bleed - self.label_height
+
+    def draw_crop_marks(self, c, x, y):
+        """Mark the trim corners of the label at (x, y), outside its bleed."""
+        c.saveState()
+        c.setLineWidth(CROP_MARK_WIDTH)
+        c.setStrokeColorCMYK(1, 1, 1, 1)  # registration black, shows on every separation
+        start = self.bleed + CROP_MARK_OFFSET
+        end = start + CROP_MARK_LENGTH
+        for corner_x, x_sign in ((x, -1), (x + self.label_width, 1)):
+            for corner_y, y_sign in ((y, -1), (y + self.label_height, 1)):
+                c.line(corner_x + x_sign * start, corner_y, corner_x + x_sign * end, corner_y)
+                c.line(corner_x, corner_y + y_sign * start, corner_x, corner_y + y_sign * end)
+        c.restoreState()
+
+    def impose(self, c, placements):
+        """Draw placements, an iterable of (draw, copies), onto canvas c.
+
+        draw(c, x, y) draws one copy of a label with its trim box's bottom left
+        corner at (x, y). Pages are started as labels overflow them, and the
+        canvas is left on the last page drawn; returns the number of copies placed.
+        """
+        c.setPageSize(self.page_size)
+        index = 0
+        current_page = 0
+        for draw, copies in placements:
+            for _ in range(copies):
+                page, x, y = self.position(index)
+                if page != current_page:
+                    c.showPage()
+                    current_page = page
+                draw(c, x, y)
+                if self.crop_marks:
+                    self.draw_crop_marks(c, x, y)
+                index += 1
+        return index
+
+
+def imposition_from_settings(params=None):
+    """The Imposition configured by the LABEL_PDF_* settings, overridden by params (e.g. request.GET).
+
+    params may give 'sheet', 'margin', 'gutter' and 'bleed' (millimetres) and
+    'crop_marks'; values that aren't valid fall back to the settings.
+    """
+    params = params or {}
+    sheet = params.get('sheet') or getattr(settings, 'LABEL_PDF_SHEET', 'letter')
+    if sheet not in SHEETS:
+        sheet = getattr(settings, 'LABEL_PDF_SHEET', 'letter')
+    margin = _length(getattr(settings, 'LABEL_PDF_MARGIN', 12.7), 0.5 * inch)
+    gutter = _length(getattr(settings, 'LABEL_PDF_GUTTER', 0), 0)
+    bleed = _length(getattr(settings, 'LABEL_PDF_BLEED', 0), 0)
+    roll_width = getattr(settings, 'LABEL_PDF_ROLL_WIDTH', None)
+    crop_marks = _flag(getattr(settings, 'LABEL_PDF_CROP_MARKS', False), False)
+    try:
+        return Imposition(
+            sheet,
+            margin=_length(params.get('margin'), margin),
+            gutter=_length(params.get('gutter'), gutter),
+            bleed=_length(params.get('bleed'), bleed),
+            crop_marks=_flag(params.get('crop_marks'), crop_marks),
+            roll_width=_length(roll_width, None) if roll_width else None,
+        )
+    except ValueError as e:
+        logger.warning("Can't impose labels as requested (%s), using the default layout", e)
+        return Imposition()
+
+
+class RasterLabelForms:
+    """Each distinct label image as a form XObject, keyed by its content hash."""
+
+    def __init__(self, canvas, width, height):
+        self.canvas = canvas
+        self.width = width
+        self.height = height
+        self._forms = {}
+
+    def form(self, label):
+        """Name of the form drawing label's image into a width x height box, or None if it can't be read."""
+        return self.image_form(label.image_hash or label.image.name, label.image.path, f'label {label.id}')
+
+    def image_form(self, key, image, description):
+        """Name of the form for image (a path or a file object) stored under key, or None if it can't be read."""
+        if key in self._forms:
+            return self._forms[key]
+        name = None
+        try:
+            reader = ImageReader(image)
+            image_width, image_height = reader.getSize()
+            # Fitted into the box without distortion, centred
+            scale = min(self.width / image_width, self.height / image_height)
+            width, height = image_width * scale, image_height * scale
+            name = f'label_{len(self._forms)}'
+            self.canvas.beginForm(name, lowerx=0, lowery=0, upperx=self.width, uppery=self.height)
+            self.canvas.drawImage(reader, (self.width - width) / 2, (self.height - height) / 2,
+                                  width=width, height=height)
+            self.canvas.endForm()
+        except OSError as e:
+            logger.warning("Can't place %s in the PDF: %s", description, e)
+            name = None
+        self._forms[key] = name
+        return name
+
+
+class VectorLabelForms:
+    """Each distinct label drawn as vector text and lines into a form XObject, keyed by fingerprint."""
+
+    def __init__(self, renderer, width, height):
+        self.renderer = renderer
+        self.width = width
+        self.height = height
+        self._forms = {}
+
+    def form(self, label):
+        key = label.fingerprint or f'label-{label.id}'
+        if key not in self._forms:
+            c = self.renderer.canvas
+            name = f'vector_label_{len(self._forms)}'
+            c.beginForm(name, lowerx=0, lowery=0, upperx=self.width, uppery=self.height)
+            self.renderer.draw(label, 0, 0, self.width, self.height)
+            c.endForm()
+            self._forms[key] = name
+        return self._forms[key]
+
+
+def place_form(name):
+    def draw(c, x, y):
+        c.saveState()
+        c.translate(x, y)
+        c.doForm(name)
+        c.restoreState()
+    return draw
+
+
+def label_placements(labels, forms):
+    """(draw, copies) for each label that has copies to print and a form."""
+    for label in labels:
+        if label.copies < 1:
+            continue
+        name = forms.form(label)
+        if name:
+            yield place_form(name), label.copies
@@ -0,0 +1,108 @@
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .metrics import JOBS, registry
+from .models import LabelJob
+from .utils import process_csv
+
+
+def enqueue_job(csv_upload, kind=LabelJob.PROCESS):
+    """Queue a processing job for csv_upload, reusing one that is already waiting.
+
+    A queued regeneration also does everything processing does, so it is
+    reused for either kind. A job queued while another runs for the same
+    upload waits for it to finish (see claim_next_job).
+    """
+    kinds = [kind, LabelJob.REGENERATE]
+    job = csv_upload.jobs.filter(kind__in=kinds, status=LabelJob.QUEUED).order_by('created_at', 'id').first()
+    if job is None:
+        job = LabelJob.objects.create(csv_upload=csv_upload, kind=kind)
+    return job
+
+
+def latest_job(csv_upload):
+    return csv_upload.jobs.order_by('-created_at', '-id').first()
+
+
+def requeue_stale_jobs():
+    """Put running jobs whose worker stopped reporting progress back in the queue."""
+    stale_after = getattr(settings, 'LABEL_JOB_STALE_AFTER', 600)
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return LabelJob.objects.filter(status=LabelJob.RUNNING, updated_at__lt=cutoff).update(
+        status=LabelJob.QUEUED, processed_rows=0, started_at=None, updated_at=timezone.now()
+    )
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to running and return it, or None.
+
+    Jobs for an upload that already has a running job are left queued, so two
+    workers never sync the same upload at once.
+    """
+    while True:
+        claimable = LabelJob.objects.filter(status=LabelJob.QUEUED).exclude(csv_upload__jobs__status=LabelJob.RUNNING)
+        job = claimable.order_by('created_at', 'id').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        # Another worker may have claimed it, or another job for its upload, between
+        # the select and the update; both are checked again in the update itself
+        claimed = claimable.filter(id=job.id).update(status=LabelJob.RUNNING, started_at=now, updated_at=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+class JobProgress:
+    """Progress callback for process_csv that writes to the job at most every `interval` seconds."""
+
+    def __init__(self, job, interval=1.0):
+        self.job = job
+        self.interval = interval
+        self._last_write = 0.0
+
+    def __call__(self, processed_rows, total_rows):
+        now = time.monotonic()
+        if processed_rows < total_rows and now - self._last_write < self.interval:
+            return
+        self._last_write = now
+        LabelJob.objects.filter(id=self.job.id).update(
+            processed_rows=processed_rows, total_rows=total_rows, updated_at=timezone.now()
+        )
+
+
+def run_job(job):
+    """Run a claimed job to completion, recording the outcome on the job."""
+    csv_upload = job.csv_upload
+    try:
+        # Regeneration is the same incremental sync: only changed rows, and labels
+        # whose files have gone missing, are re-rendered
+        process_csv(csv_upload, progress=JobProgress(job), repair=job.kind == LabelJob.REGENERATE)
+    except Exception:
+        status, error = LabelJob.FAILED, traceback.format_exc()
+    else:
+        status, error = LabelJob.DONE, ''
+
+    LabelJob.objects.filter(id=job.id).update(
+        status=status, error=error, finished_at=timezone.now(), updated_at=timezone.now()
+    )
+    JOBS.inc(kind=job.kind, status=status)
+    registry.flush(force=True)
+    job.refresh_from_db()
+    return job
+
+
+def job_status(job):
+    """JSON-serialisable summary of a job for the status endpoint."""
+    if job is None:
+        return {'status': None}
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'error': job.error.strip().splitlines()[-1] if job.error else '',
+    }
@@ -0,0 +1,110 @@
+import json
+import logging
+import shutil
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from labels.benchmarks import STAGES, compare_results, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark label ingestion, rendering and exports on synthetic CSVs. Runs against a '
+        'throwaway test database and MEDIA_ROOT; results can be saved as a JSON baseline and '
+        'compared with a later run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=[100, 1000, 10000],
+            help='Synthetic CSV sizes to benchmark (default: 100 1000 10000).',
+        )
+        parser.add_argument(
+            '--stages', nargs='+', choices=STAGES, default=list(STAGES),
+            help='Stages to report. Ingest always runs, the other stages use its labels.',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data.')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Render workers for the ingest stage (default: LABEL_RENDER_WORKERS). '
+                 'Peak RSS only covers this process, not the workers.',
+        )
+        parser.add_argument('--save', metavar='PATH', help='Write the results to PATH as JSON.')
+        parser.add_argument('--compare', metavar='PATH', help='Compare the results with a JSON baseline.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.1,
+            help='Relative change that counts as a regression when comparing (default: 0.1).',
+        )
+        parser.add_argument(
+            '--fail-on-regression', action='store_true',
+            help='Exit with an error if the comparison finds a regression.',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read baseline {options['compare']}: {e}")
+
+        results = self.run(options)
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Saved results to {options['save']}")
+
+        if baseline is not None:
+            regressions = self.report_comparison(results, baseline, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{regressions} metric(s) regressed by more than {options["threshold"]:.0%}')
+
+    def run(self, options):
+        media_root = tempfile.mkdtemp(prefix='bench_labels_')
+        # Keep the pipeline's progress messages out of the report
+        logger = logging.getLogger('labels')
+        log_level = logger.level
+        logger.setLevel(logging.WARNING)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        self.stdout.write(
+            f"{'stage':<11}{'rows':>7}{'labels/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS':>11}{'output':>11}"
+        )
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                return run_benchmarks(
+                    options['rows'], stages=options['stages'], seed=options['seed'],
+                    workers=options['workers'], report=self.report_stage,
+                )
+        finally:
+            logger.setLevel(log_level)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def report_stage(self, stage, rows, result):
+        def ms(value):
+            return '-' if value is None else f'{value:.2f}'
+
+        def mb(value):
+            return '-' if value is None else f'{value / 1024 / 1024:.1f} MB'
+
+        self.stdout.write(
+            f"{stage:<11}{rows:>7}{result['items_per_sec'] or 0:>11.1f}{ms(result['p50_ms']):>10}"
+            f"{ms(result['p99_ms']):>10}{mb(result['peak_rss_bytes']):>11}{mb(result['output_bytes']):>11}"
+        )
+
+    def report_comparison(self, results, baseline, threshold):
+        self.stdout.write(f"\nCompared with baseline from {baseline.get('meta', {}).get('created', '?')}:")
+        regressions = 0
+        for stage, rows, metric, old, new, change, regressed in compare_results(results, baseline, threshold):
+            line = f"{stage:<11}{rows:>7}  {metric:<15}{old:>14.2f} -> {new:<14.2f}{change:+.1%}"
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f'{line}  REGRESSED'))
+            else:
+                self.stdout.write(line)
+        return regressions
@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand
+from labels.jobs import claim_next_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Process queued label jobs (CSV uploads and regenerations) from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Process every queued job and exit instead of polling forever.',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help='Seconds to sleep between checks when the queue is empty.',
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        self.stdout.write("Label worker started")
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                requeue_stale_jobs()
+                continue
+
+            self.stdout.write(f"Running {job}")
+            job = run_job(job)
+            if job.status == job.FAILED:
+                self.stderr.write(self.style.ERROR(f"Job {job.id} failed:\n{job.error}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Job {job.id} done ({job.processed_rows} rows)"))
@@ -0,0 +1,312 @@
+"""Counters and histograms for the label pipeline, exposed in Prometheus text format.
+
+Labels are processed by the web server, run_label_worker and render worker
+processes, so each process keeps its own metrics and writes a snapshot of
+them to LABEL_METRICS_DIR every few seconds. The metrics view merges the
+snapshots of every process into one set of totals.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from django.conf import settings
+
+# Upper bounds of the stage timing buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Minimum seconds between snapshot writes from one process
+FLUSH_INTERVAL = 5.0
+
+# Snapshot file holding the totals of processes that have exited
+ARCHIVE_SNAPSHOT = 'archive.json'
+
+
+def metrics_dir():
+    return getattr(settings, 'LABEL_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'label_metrics'))
+
+
+class Counter:
+    """A monotonically increasing count, per combination of label values."""
+    kind = 'counter'
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.flush()
+
+    def snapshot(self):
+        return self.dump(self.values)
+
+    @staticmethod
+    def dump(values):
+        return [[list(key), value] for key, value in values.items()]
+
+    @staticmethod
+    def merge(samples, other):
+        for key, value in other:
+            key = tuple(key)
+            samples[key] = samples.get(key, 0) + value
+
+
+class Histogram(Counter):
+    """Observations counted into cumulative buckets, with their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+        self.registry.flush()
+
+    @staticmethod
+    def dump(values):
+        return [[list(key), counts, total] for key, (counts, total) in values.items()]
+
+    @staticmethod
+    def merge(samples, other):
+        for key, counts, total in other:
+            key = tuple(key)
+            if key in samples:
+                old_counts, old_total = samples[key]
+                counts = [a + b for a, b in zip(old_counts, counts)]
+                total += old_total
+            samples[key] = (list(counts), total)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _after_fork(self):
+        # A forked child (e.g. a render worker) starts from zero rather than
+        # reporting its parent's values a second time. The lock is replaced
+        # because another thread may have held it when the parent forked.
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.values = {}
+        self._last_flush = 0.0
+
+    def snapshot_path(self, pid=None):
+        return os.path.join(metrics_dir(), f'{pid or os.getpid()}.json')
+
+    def flush(self, force=False):
+        """Write this process's snapshot, at most every FLUSH_INTERVAL seconds unless forced."""
+        now = time.monotonic()
+        if not force and now - self._last_flush < FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        path = self.snapshot_path()
+        partial = f'{path}.part'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(partial, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(partial, path)
+        except OSError:
+            # Metrics are best effort and must never break label processing
+            pass
+
+    def _read_snapshots(self, exclude=()):
+        """Return {path: snapshot} for the snapshot files in LABEL_METRICS_DIR."""
+        snapshots = {}
+        try:
+            names = os.listdir(metrics_dir())
+        except OSError:
+            return snapshots
+        for filename in names:
+            path = os.path.join(metrics_dir(), filename)
+            if not filename.endswith('.json') or path in exclude:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots[path] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def _merge(self, snapshots):
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                if name in self.metrics:
+                    self.metrics[name].merge(merged[name], samples)
+        return merged
+
+    def compact(self):
+        """Fold the snapshots of processes that have exited into one archive file.
+
+        Render worker pools come and go with each job, so without this the
+        directory would gain a file for every worker process ever started.
+        """
+        try:
+            import fcntl
+        except ImportError:
+            return
+        archive_path = os.path.join(metrics_dir(), ARCHIVE_SNAPSHOT)
+        try:
+            os.makedirs(metrics_dir(), exist_ok=True)
+            with open(os.path.join(metrics_dir(), 'compact.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                dead = {
+                    path: snapshot for path, snapshot in self._read_snapshots().items()
+                    if path != archive_path and not _process_alive(os.path.basename(path)[:-len('.json')])
+                }
+                if not dead:
+                    return
+                archive = self._read_snapshots().get(archive_path, {})
+                merged = self._merge([archive, *dead.values()])
+                partial = f'{archive_path}.part'
+                with open(partial, 'w') as f:
+                    json.dump({name: self.metrics[name].dump(values) for name, values in merged.items()}, f)
+                os.replace(partial, archive_path)
+                for path in dead:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def merged(self):
+        """Merge the snapshots of every process, using this process's live values for itself."""
+        self.compact()
+        snapshots = self._read_snapshots(exclude={self.snapshot_path()})
+        return self._merge([self.snapshot(), *snapshots.values()])
+
+    def render_prometheus(self):
+        """All metrics, merged across processes, in the Prometheus text exposition format."""
+        lines = []
+        for name, samples in self.merged().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for key, value in sorted(samples.items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    lines.append(f'{name}_bucket{_format_labels(labels + [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _process_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+STAGE_SECONDS = registry.histogram(
+    'label_stage_seconds',
+    'Time spent in each stage of label ingestion, rendering and export.',
+    ['stage'],
+)
+CSV_ROWS = registry.counter(
+    'label_csv_rows_total',
+    'CSV rows ingested, by outcome (created, kept or skipped).',
+    ['outcome'],
+)
+LABELS_RENDERED = registry.counter(
+    'label_images_rendered_total',
+    'Label images rendered.',
+)
+RENDER_CACHE = registry.counter(
+    'label_render_cache_total',
+    'Labels that needed an image during a sync, by whether the render cache already had it.',
+    ['result'],
+)
+RENDITIONS = registry.counter(
+    'label_renditions_total',
+    'Labels served by the render endpoint, by format and whether the rendition cache had them.',
+    ['format', 'cache'],
+)
+JOBS = registry.counter(
+    'label_jobs_total',
+    'Label jobs finished, by kind and final status.',
+    ['kind', 'status'],
+)
+EXPORTS = registry.counter(
+    'label_exports_total',
+    'Exports served, by kind and whether they came from the export cache.',
+    ['kind', 'cache'],
+)
+EXPORT_BYTES = registry.counter(
+    'label_export_bytes_total',
+    'Bytes of exports built, by kind.',
+    ['kind'],
+)
+
+
+@contextmanager
+def timed(stage):
+    """Time the block and record it in label_stage_seconds under stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
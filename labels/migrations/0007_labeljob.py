@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0006_alter_barcodeimage_image_alter_csvupload_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabelJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('process', 'Process'), ('regenerate', 'Regenerate')], default='process', max_length=20)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('total_rows', models.PositiveIntegerField(default=0)),
+                ('processed_rows', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('csv_upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='labels.csvupload')),
+            ],
+        ),
+    ]
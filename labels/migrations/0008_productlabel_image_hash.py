@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0007_labeljob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlabel',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
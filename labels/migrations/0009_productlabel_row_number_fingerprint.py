@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0008_productlabel_image_hash'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productlabel',
+            options={'ordering': ['row_number', 'id']},
+        ),
+        migrations.AddField(
+            model_name='productlabel',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='productlabel',
+            name='row_number',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='productlabel',
+            index=models.Index(fields=['csv_upload', 'row_number'], name='label_upload_row_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productlabel',
+            index=models.Index(fields=['csv_upload', 'fingerprint'], name='label_upload_fp_idx'),
+        ),
+    ]
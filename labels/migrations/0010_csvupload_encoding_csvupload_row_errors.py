@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0009_productlabel_row_number_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvupload',
+            name='encoding',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='csvupload',
+            name='row_errors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0010_csvupload_encoding_csvupload_row_errors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvupload',
+            name='sync_generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvupload',
+            name='sync_resume_row',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productlabel',
+            name='sync_generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
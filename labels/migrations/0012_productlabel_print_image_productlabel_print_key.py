@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0011_csvupload_sync_generation_csvupload_sync_resume_row_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlabel',
+            name='print_image',
+            field=models.FileField(blank=True, upload_to='labels/print/'),
+        ),
+        migrations.AddField(
+            model_name='productlabel',
+            name='print_key',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0012_productlabel_print_image_productlabel_print_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlabel',
+            name='preview',
+            field=models.ImageField(blank=True, upload_to='labels/previews/'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0013_productlabel_preview'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='csvupload',
+            index=models.Index(fields=['uploaded_at', 'id'], name='upload_uploaded_idx'),
+        ),
+    ]
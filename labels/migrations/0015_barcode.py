@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0014_csvupload_upload_uploaded_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Barcode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gtin', models.CharField(max_length=14, unique=True)),
+                ('image', models.ImageField(upload_to='barcodes/')),
+                ('content_hash', models.CharField(db_index=True, max_length=64)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
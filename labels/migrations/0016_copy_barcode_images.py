@@ -0,0 +1,57 @@
+import hashlib
+import os
+import re
+from django.core.files.base import ContentFile
+from django.db import migrations, transaction
+
+BARCODE_FILENAME = re.compile(r'^EAN_(\d{8,14})\.(png|jpe?g|gif)$', re.IGNORECASE)
+
+
+def copy_barcode_images(apps, schema_editor):
+    """Move per-upload barcode images into the shared library; the newest upload wins a GTIN.
+
+    The per-upload files are deleted once the copies are committed, as
+    nothing refers to them after BarcodeImage is dropped.
+    """
+    BarcodeImage = apps.get_model('labels', 'BarcodeImage')
+    Barcode = apps.get_model('labels', 'Barcode')
+    storage = Barcode._meta.get_field('image').storage
+    old_storage = BarcodeImage._meta.get_field('image').storage
+    old_names = set()
+    for barcode_image in BarcodeImage.objects.order_by('upload_id', 'id').iterator():
+        if barcode_image.image.name:
+            old_names.add(barcode_image.image.name)
+        filename = os.path.basename(barcode_image.image.name)
+        match = BARCODE_FILENAME.match(filename)
+        if not match:
+            continue
+        try:
+            with barcode_image.image.open('rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        digest = hashlib.sha256(data).hexdigest()
+        name = f'barcodes/{digest[:2]}/{digest}{os.path.splitext(filename)[1].lower()}'
+        if not storage.exists(name):
+            name = storage.save(name, ContentFile(data))
+        Barcode.objects.update_or_create(
+            gtin=match.group(1),
+            defaults={'image': name, 'content_hash': digest, 'filename': filename},
+        )
+
+    def delete_old_files():
+        for old_name in old_names:
+            old_storage.delete(old_name)
+
+    transaction.on_commit(delete_old_files, using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0015_barcode'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_barcode_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:16
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0016_copy_barcode_images'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='BarcodeImage',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0017_delete_barcodeimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderedLabel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64, unique=True)),
+                ('image', models.ImageField(upload_to='labels/cas/')),
+                ('image_hash', models.CharField(max_length=64)),
+                ('preview', models.ImageField(blank=True, upload_to='labels/cas/')),
+                ('print_image', models.FileField(blank=True, upload_to='labels/cas/')),
+                ('print_key', models.CharField(blank=True, max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='productlabel',
+            name='rendered',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='labels', to='labels.renderedlabel'),
+        ),
+    ]
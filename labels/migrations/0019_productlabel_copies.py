@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0018_renderedlabel_productlabel_rendered'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlabel',
+            name='copies',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
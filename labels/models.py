@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from .storage import OverwriteStorage
 import os
 
@@ -7,8 +8,6 @@ import os
 def overwrite_filename(instance, filename):
     if isinstance(instance, CSVUpload):
         upload_dir = 'csv_uploads'
-    elif isinstance(instance, BarcodeImage):
-        upload_dir = 'barcode_images'
     else:
         upload_dir = 'misc_uploads'
     return os.path.join(upload_dir, filename)
@@ -26,6 +25,19 @@ class CSVUpload(models.Model):
     file = models.FileField(upload_to=overwrite_filename, storage=OverwriteStorage())
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
+    # Encoding the file was decoded with and the rows that couldn't be used
+    encoding = models.CharField(max_length=32, blank=True)
+    row_errors = models.JSONField(default=list, blank=True)
+    # Labels touched by the latest sync carry its generation; the resume row is
+    # the first CSV row not yet committed, or None once the sync has finished
+    sync_generation = models.PositiveIntegerField(default=0)
+    sync_resume_row = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Upload history is paged newest first by (uploaded_at, id)
+            models.Index(fields=['uploaded_at', 'id'], name='upload_uploaded_idx'),
+        ]
 
     def __str__(self):
         return f"CSV Upload {self.id} - {self.uploaded_at}"
@@ -33,22 +45,46 @@ class CSVUpload(models.Model):
     def delete(self, *args, **kwargs):
         if self.file:
             self.file.delete(save=False)
-        super().delete(*args, **kwargs)
+        from .export_cache import invalidate_export_cache
+        invalidate_export_cache(self)
+        result = super().delete(*args, **kwargs)
+        # Rendered files the deleted labels shared stay until unused for the grace period
+        from .render_cache import collect_unused_renders
+        collect_unused_renders()
+        return result
+
+class Barcode(models.Model):
+    """Barcode image for a GTIN, shared by every upload (see labels.barcode_library).
 
-class BarcodeImage(models.Model):
-    upload = models.ForeignKey(CSVUpload, on_delete=models.CASCADE, related_name='barcodes')
-    image = models.ImageField(upload_to=overwrite_filename, storage=OverwriteStorage())
+    Files are stored under their content hash, so identical images are kept once.
+    """
+    gtin = models.CharField(max_length=14, unique=True)
+    image = models.ImageField(upload_to='barcodes/')
+    content_hash = models.CharField(max_length=64, db_index=True)
     filename = models.CharField(max_length=255, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
-    def save(self, *args, **kwargs):
-        if self.image and not self.filename:
-            self.filename = os.path.basename(self.image.name)
-        super().save(*args, **kwargs)
+    def __str__(self):
+        return f"Barcode {self.gtin}"
 
-    def delete(self, *args, **kwargs):
-        if self.image:
-            self.image.delete(save=False)
-        super().delete(*args, **kwargs)
+class RenderedLabel(models.Model):
+    """Files rendered for one label fingerprint, shared by every label with that content.
+
+    Labels reference it through ProductLabel.rendered; labels.render_cache
+    deletes entries (and their files) once no label references them.
+    """
+    fingerprint = models.CharField(max_length=64, unique=True)
+    image = models.ImageField(upload_to='labels/cas/')
+    image_hash = models.CharField(max_length=64)
+    preview = models.ImageField(upload_to='labels/cas/', blank=True)
+    print_image = models.FileField(upload_to='labels/cas/', blank=True)
+    print_key = models.CharField(max_length=16, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last time a sync picked this entry up, unreferenced entries are kept for a grace period after it
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"Rendered label {self.fingerprint[:12]}"
 
 class ProductLabel(models.Model):
     csv_upload = models.ForeignKey(CSVUpload, on_delete=models.CASCADE, related_name='labels')
@@ -64,6 +100,70 @@ class ProductLabel(models.Model):
     gtin = models.CharField(max_length=14)
     manufacturer = models.TextField()
     image = models.ImageField(upload_to='labels/', blank=True, null=True)
+    # SHA-256 of the rendered image file, used to key cached exports
+    image_hash = models.CharField(max_length=64, blank=True)
+    # Position of the row in the CSV file, labels are listed in this order
+    row_number = models.PositiveIntegerField(default=0)
+    # Times the label is placed in PDF exports, from the row's Copies column
+    copies = models.PositiveIntegerField(default=1)
+    # SHA-256 of everything the image was rendered from, see utils.label_fingerprint
+    fingerprint = models.CharField(max_length=64, blank=True)
+    # Shared render the image, preview and print image come from; null for labels
+    # rendered before the render cache, whose files belong to the label alone
+    rendered = models.ForeignKey(RenderedLabel, on_delete=models.PROTECT, null=True, blank=True, related_name='labels')
+    # CSVUpload.sync_generation of the last sync that saw this row
+    sync_generation = models.PositiveIntegerField(default=0)
+    # Downscaled copy shown in the label list, see labels.previews
+    preview = models.ImageField(upload_to='labels/previews/', blank=True)
+    # CMYK TIFF rendered with the image when LABEL_RENDER_PRINT_TIFF is on, and the
+    # cmyk.print_options_key() it was encoded with; exports copy it while that matches
+    print_image = models.FileField(upload_to='labels/print/', blank=True)
+    print_key = models.CharField(max_length=16, blank=True)
+
+    class Meta:
+        ordering = ['row_number', 'id']
+        indexes = [
+            models.Index(fields=['csv_upload', 'row_number'], name='label_upload_row_idx'),
+            models.Index(fields=['csv_upload', 'fingerprint'], name='label_upload_fp_idx'),
+        ]
     
     def __str__(self):
         return f"{self.product_name} - {self.product_code}"
+
+class LabelJob(models.Model):
+    """Background CSV processing job, picked up by `manage.py run_label_worker`."""
+    PROCESS = 'process'
+    REGENERATE = 'regenerate'
+    KIND_CHOICES = [
+        (PROCESS, 'Process'),
+        (REGENERATE, 'Regenerate'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    csv_upload = models.ForeignKey(CSVUpload, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=PROCESS)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job {self.id} for upload {self.csv_upload_id} - {self.status}"
+
+    @property
+    def is_active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
@@ -0,0 +1,104 @@
+"""Keyset ("seek") pagination for the upload history and label list.
+
+Offset pagination re-reads every row before the page, so later pages get
+slower as the tables grow. A keyset page instead starts from the ordering
+values of the row it follows, which an index can seek to directly, so
+every page costs the same however much history there is.
+"""
+import base64
+import binascii
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    data = json.dumps(values, default=lambda value: value.isoformat(), separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """The ordering values in a cursor, or None if it isn't one."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def _field_values(model, keys, values):
+    """Cursor values converted to the key fields' types, or None if any doesn't fit its field."""
+    if values is None:
+        return None
+    try:
+        values = [model._meta.get_field(key.lstrip('-')).to_python(value) for key, value in zip(keys, values)]
+    except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+        return None
+    return None if None in values else values
+
+
+class KeysetPage:
+    def __init__(self, items, keys, has_previous, has_next):
+        self.items = items
+        self.keys = keys
+        self.has_previous = has_previous
+        self.has_next = has_next
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _cursor(self, item):
+        return encode_cursor([getattr(item, key.lstrip('-')) for key in self.keys])
+
+    @property
+    def previous_cursor(self):
+        return self._cursor(self.items[0]) if self.has_previous and self.items else None
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.items[-1]) if self.has_next and self.items else None
+
+
+def _seek(keys, values, forward):
+    """Q for the rows after (or, if not forward, before) the row with these ordering values."""
+    condition = Q()
+    equal = {}
+    for key, value in zip(keys, values):
+        name = key.lstrip('-')
+        lookup = 'lt' if key.startswith('-') == forward else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def keyset_page(queryset, keys, per_page, after=None, before=None):
+    """Return the KeysetPage of queryset ordered by keys after (or before) a cursor.
+
+    keys are order_by() field names and must end with a unique one, e.g.
+    ('-uploaded_at', '-id'). after and before are cursors from an earlier
+    page's next_cursor and previous_cursor; invalid cursors, including ones
+    whose values don't fit the key fields, give the first page.
+    """
+    keys = tuple(keys)
+    after_values = _field_values(queryset.model, keys, decode_cursor(after, len(keys)))
+    before_values = None
+    if after_values is None:
+        before_values = _field_values(queryset.model, keys, decode_cursor(before, len(keys)))
+
+    if before_values is not None:
+        reverse_keys = [key[1:] if key.startswith('-') else f'-{key}' for key in keys]
+        rows = list(queryset.filter(_seek(keys, before_values, forward=False)).order_by(*reverse_keys)[:per_page + 1])
+        has_previous = len(rows) > per_page
+        return KeysetPage(rows[:per_page][::-1], keys, has_previous=has_previous, has_next=True)
+
+    if after_values is not None:
+        queryset = queryset.filter(_seek(keys, after_values, forward=True))
+    rows = list(queryset.order_by(*keys)[:per_page + 1])
+    return KeysetPage(rows[:per_page], keys, has_previous=after_values is not None, has_next=len(rows) > per_page)
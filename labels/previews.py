@@ -0,0 +1,69 @@
+import io
+import logging
+from PIL import Image, features
+from django.conf import settings
+from django.core.files.base import ContentFile
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_FORMATS = ('webp', 'png')
+
+
+def preview_width():
+    return max(1, int(getattr(settings, 'LABEL_PREVIEW_WIDTH', 300)))
+
+
+def preview_format():
+    """'webp' or 'png' (LABEL_PREVIEW_FORMAT); PNG when Pillow was built without WebP."""
+    preview = getattr(settings, 'LABEL_PREVIEW_FORMAT', 'webp')
+    if preview not in PREVIEW_FORMATS or (preview == 'webp' and not features.check('webp')):
+        return 'png'
+    return preview
+
+
+def preview_name(label):
+    return f'label_{label.id}.{preview_format()}'
+
+
+def preview_bytes(img):
+    """Encode a downscaled preview of a rendered label for the label list."""
+    with timed('preview_encode'):
+        rgb_img = img if img.mode == 'RGB' else img.convert('RGB')
+        width = min(preview_width(), rgb_img.width)
+        if rgb_img.width % width == 0:
+            # Labels are drawn at 300 DPI, so a whole-factor box reduce keeps text crisp and is cheap
+            preview = rgb_img.reduce(rgb_img.width // width)
+        else:
+            height = max(1, round(rgb_img.height * width / rgb_img.width))
+            preview = rgb_img.resize((width, height), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        if preview_format() == 'webp':
+            preview.save(output, format='WEBP', quality=int(getattr(settings, 'LABEL_PREVIEW_QUALITY', 80)), method=2)
+        else:
+            preview.save(output, format='PNG')
+    return output.getvalue()
+
+
+def ensure_preview(label):
+    """Give a label rendered before previews existed its preview, from its image; return False if it has no image."""
+    if label.preview:
+        return True
+    if not label.image:
+        return False
+    field = type(label).preview.field
+    name = field.generate_filename(label, preview_name(label))
+    if not field.storage.exists(name):
+        try:
+            with Image.open(label.image.path) as img:
+                img.load()
+                data = preview_bytes(img)
+        except OSError as e:
+            logger.warning("Can't make a preview of label %s: %s", label.id, e)
+            return False
+        # Another request may have written it meanwhile; keep a single file
+        field.storage.delete(name)
+        name = field.storage.save(name, ContentFile(data))
+    label.preview.name = name
+    type(label).objects.filter(id=label.id).update(preview=name)
+    return True
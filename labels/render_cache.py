@@ -0,0 +1,148 @@
+"""Rendered label files shared across uploads, keyed by label fingerprint.
+
+A label's fingerprint (utils.label_fingerprint) hashes everything its image
+is rendered from, so two labels with the same fingerprint, in any upload,
+have identical files. Each fingerprint is rendered once into
+MEDIA_ROOT/labels/cas/<fp[:2]>/<fp>.<ext> and recorded as a RenderedLabel;
+labels point at it and share its files.
+
+Labels reference entries through ProductLabel.rendered, so an entry's
+reference count is the number of labels pointing at it. Entries nobody
+references are deleted with their files by collect_unused_renders(), after a
+grace period so a sync that has just looked an entry up can still attach it.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.utils import timezone
+from .metrics import timed
+from .models import RenderedLabel
+from .previews import preview_format
+from .storage import atomic_write
+
+logger = logging.getLogger(__name__)
+
+CAS_DIR = RenderedLabel.image.field.upload_to
+
+
+def gc_grace_seconds():
+    return int(getattr(settings, 'LABEL_RENDER_CACHE_GC_GRACE', 3600))
+
+
+def cas_name(fingerprint, extension):
+    return f'{CAS_DIR}{fingerprint[:2]}/{fingerprint}.{extension}'
+
+
+def _write(name, data):
+    # Files in the cache are always complete, even if a sync dies while writing one
+    atomic_write(RenderedLabel.image.field.storage.path(name), data)
+    return name
+
+
+def cached_renders(fingerprints, touch=True):
+    """Map fingerprint -> RenderedLabel for the fingerprints already rendered.
+
+    Entries found are touched, so the garbage collector leaves them alone
+    while the caller attaches them to its labels.
+    """
+    fingerprints = set(fingerprints)
+    if not fingerprints:
+        return {}
+    found = {rendered.fingerprint: rendered for rendered in RenderedLabel.objects.filter(fingerprint__in=fingerprints)}
+    if touch and found:
+        RenderedLabel.objects.filter(id__in=[rendered.id for rendered in found.values()]).update(last_used_at=timezone.now())
+    return found
+
+
+def with_files(entries):
+    """The entries of {fingerprint: RenderedLabel} whose image file is still in storage."""
+    storage = RenderedLabel.image.field.storage
+    return {fingerprint: entry for fingerprint, entry in entries.items() if storage.exists(entry.image.name)}
+
+
+def store_renders(renders, print_key=None):
+    """Save [(fingerprint, utils.LabelFiles)] to the cache; return {fingerprint: RenderedLabel}."""
+    entries = []
+    with timed('file_write'):
+        for fingerprint, files in renders:
+            entry = RenderedLabel(
+                fingerprint=fingerprint,
+                image=_write(cas_name(fingerprint, 'png'), files.image),
+                image_hash=hashlib.sha256(files.image).hexdigest(),
+            )
+            if files.preview is not None:
+                entry.preview = _write(cas_name(fingerprint, preview_format()), files.preview)
+            if files.print_image is not None:
+                entry.print_image = _write(cas_name(fingerprint, 'tif'), files.print_image)
+                entry.print_key = print_key or ''
+            entries.append(entry)
+    if not entries:
+        return {}
+    with timed('db_write'):
+        # Another sync may have stored the same fingerprint meanwhile; its row wins
+        RenderedLabel.objects.bulk_create(entries, ignore_conflicts=True)
+        return cached_renders((entry.fingerprint for entry in entries), touch=False)
+
+
+def attach(label, rendered):
+    """Point a label at a cache entry and its files."""
+    label.rendered = rendered
+    label.image.name = rendered.image.name
+    label.image_hash = rendered.image_hash
+    label.preview.name = rendered.preview.name
+    label.print_image.name = rendered.print_image.name
+    label.print_key = rendered.print_key
+
+
+def _delete_unused(ids, cutoff):
+    with transaction.atomic():
+        # Entries a sync looked up since the select have been touched and are
+        # skipped; PROTECT stops the delete if one was attached meanwhile
+        count, _ = RenderedLabel.objects.filter(id__in=ids, last_used_at__lte=cutoff).delete()
+    return count
+
+
+def collect_unused_renders(grace_seconds=None, batch_size=500):
+    """Delete cache entries no label references, unused for grace_seconds, and their files; return how many."""
+    if grace_seconds is None:
+        grace_seconds = gc_grace_seconds()
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    unused = RenderedLabel.objects.filter(labels__isnull=True, last_used_at__lte=cutoff)
+    storage = RenderedLabel.image.field.storage
+    deleted = 0
+    last_id = 0
+    while True:
+        chunk = list(
+            unused.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'fingerprint', 'image', 'preview', 'print_image')[:batch_size]
+        )
+        if not chunk:
+            break
+        ids = [row[0] for row in chunk]
+        last_id = ids[-1]
+        try:
+            count = _delete_unused(ids, cutoff)
+        except ProtectedError:
+            # One of them was attached meanwhile: delete the others one at a time
+            count = 0
+            for entry_id in ids:
+                try:
+                    count += _delete_unused([entry_id], cutoff)
+                except ProtectedError:
+                    logger.info("Render cache: entry %s came back into use during collection", entry_id)
+        # Keep the files of entries that were skipped, or rendered again since (same names)
+        remaining = set(
+            RenderedLabel.objects.filter(fingerprint__in=[row[1] for row in chunk]).values_list('fingerprint', flat=True)
+        )
+        for _, fingerprint, *names in chunk:
+            if fingerprint not in remaining:
+                for name in names:
+                    if name:
+                        storage.delete(name)
+        deleted += count
+    if deleted:
+        logger.info("Render cache: removed %s unused entries", deleted)
+    return deleted
@@ -0,0 +1,97 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from types import SimpleNamespace
+from django.conf import settings
+
+# ProductLabel fields generate_label_image reads; workers only get these
+RENDER_FIELDS = (
+    'product_name',
+    'mrp',
+    'quality',
+    'size',
+    'net_quantity',
+    'product_code',
+    'design_color',
+    'mfg_month',
+    'mfg_year',
+    'gtin',
+    'manufacturer',
+)
+
+
+def label_render_data(label):
+    """Plain, picklable copy of the label fields needed to render it."""
+    return {field: getattr(label, field) for field in RENDER_FIELDS}
+
+
+def render_workers():
+    """Number of worker processes to render with (1 renders in-process)."""
+    return max(1, int(getattr(settings, 'LABEL_RENDER_WORKERS', 1)))
+
+
+def _init_worker():
+    # With the spawn start method the worker starts without Django set up
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+    from .fonts import font_registry
+    font_registry.warm()
+
+
+def _render(job, print_tiff=False):
+    # Imported here so unpickling this function in a fresh worker doesn't
+    # import the models before _init_worker has set Django up
+    from .utils import render_label_files
+
+    data, barcode_path = job
+    return render_label_files(SimpleNamespace(**data), barcode_path=barcode_path, print_tiff=print_tiff)
+
+
+def _render_chunk(jobs, print_tiff=False):
+    from .metrics import registry
+    images = [_render(job, print_tiff) for job in jobs]
+    # Worker processes exit without flushing, so report timings after every chunk
+    registry.flush(force=True)
+    return images
+
+
+class RenderPool:
+    """Render batches of (label data, barcode path) jobs, in worker processes if more than one.
+
+    submit() returns an iterator over the batch's utils.LabelFiles (PNG,
+    preview and print TIFF bytes) in job order; the TIFF is None unless
+    print_tiff is set. With
+    workers the batch starts rendering right away, so the caller can prepare
+    the next batch (e.g. write it to the database) while this one renders;
+    without them each label is rendered as the iterator is consumed.
+    """
+
+    def __init__(self, workers=None, print_tiff=False):
+        self.workers = render_workers() if workers is None else workers
+        self.print_tiff = print_tiff
+        self._executor = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._executor is not None:
+            # Don't wait for batches nobody is going to collect
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def submit(self, jobs):
+        jobs = list(jobs)
+        if self._executor is None:
+            return map(partial(_render, print_tiff=self.print_tiff), jobs)
+
+        chunksize = max(1, min(32, len(jobs) // (self.workers * 4)))
+        futures = [
+            self._executor.submit(_render_chunk, jobs[i:i + chunksize], self.print_tiff)
+            for i in range(0, len(jobs), chunksize)
+        ]
+        return (image_data for future in futures for image_data in future.result())
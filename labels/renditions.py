@@ -0,0 +1,187 @@
+"""Labels rendered on demand at other resolutions and formats, cached on disk.
+
+Stored labels are 300 DPI PNGs. The render endpoint also draws a label at
+another DPI (72 for screens, 600 for print) as PNG, WebP or CMYK TIFF, and
+keeps the result under MEDIA_ROOT/renditions/<key[:2]>/<key>.<ext>. The key
+is the label's fingerprint at that DPI plus the format, so a label whose
+content changes gets new renditions and its old ones age out.
+
+The cache is bounded by LABEL_RENDITION_CACHE_BYTES. Serving a rendition
+bumps its file's mtime, and once the cache grows past the limit the least
+recently used files are deleted until it is back under LOW_WATER of it.
+Processes check the size after writing a twentieth of the limit, so the
+cache can briefly overshoot by that much per process.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from PIL import Image
+from django.conf import settings
+from .barcode_library import barcode_paths
+from .cmyk import print_options_key, print_tiff_bytes
+from .metrics import timed
+from .storage import PARTIAL_SUFFIX, atomic_write
+from .utils import draw_label_image, encode_label_png, label_fingerprint, stored_label_image
+
+logger = logging.getLogger(__name__)
+
+# Format -> (file extension, content type)
+RENDITION_FORMATS = {
+    'png': ('png', 'image/png'),
+    'webp': ('webp', 'image/webp'),
+    'tiff': ('tif', 'image/tiff'),
+}
+
+# Labels are designed, and stored, at this resolution
+NATIVE_DPI = 300
+MIN_DPI = 72
+MAX_DPI = 1200
+
+RENDITION_DIR = 'renditions'
+
+# Eviction stops once the cache is back under this fraction of the limit
+LOW_WATER = 0.9
+
+_lock = threading.Lock()
+_written_since_check = None
+
+
+def cache_limit():
+    return int(getattr(settings, 'LABEL_RENDITION_CACHE_BYTES', 256 * 1024 * 1024))
+
+
+def rendition_dir():
+    return os.path.join(settings.MEDIA_ROOT, RENDITION_DIR)
+
+
+def rendition_key(fingerprint, dpi, fmt):
+    options = {'fingerprint': fingerprint, 'dpi': dpi, 'format': fmt}
+    if fmt == 'tiff':
+        options['print'] = print_options_key()
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
+
+
+def rendition_path(key, fmt):
+    return os.path.join(rendition_dir(), key[:2], f'{key}.{RENDITION_FORMATS[fmt][0]}')
+
+
+def draw_rendition(label, barcode_path, dpi):
+    """(image, pasted) for label at dpi, as utils.draw_label_image returns them.
+
+    From 300 DPI up the label is drawn at dpi, with fonts, border and padding
+    scaled to it. Below that the 300 DPI drawing is downscaled, which keeps
+    small text legible where fonts that small would be hinted out of shape.
+    """
+    if dpi >= NATIVE_DPI:
+        return draw_label_image(label, barcode_path, dpi=dpi)
+    img, _ = draw_label_image(label, barcode_path, dpi=NATIVE_DPI)
+    size = (int(2 * dpi), int(3 * dpi))
+    if img.width % size[0] == 0 and img.width // size[0] == img.height // size[1]:
+        img = img.reduce(img.width // size[0])
+    else:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    # Resampling mixes colours, so the palette is only used if it still holds the result
+    return img, [img]
+
+
+def rendition_bytes(label, barcode_path, dpi, fmt):
+    with timed('rendition_render'):
+        img, pasted = draw_rendition(label, barcode_path, dpi)
+    if fmt == 'png':
+        with timed('png_encode'):
+            return encode_label_png(img, dpi, pasted)
+    if fmt == 'tiff':
+        # Encoded from the stored image like export TIFFs, so it matches them at 300 DPI
+        return print_tiff_bytes(stored_label_image(img, pasted), dpi)
+    with timed('rendition_encode'):
+        output = io.BytesIO()
+        img.save(output, format='WEBP', lossless=True)
+    return output.getvalue()
+
+
+def _stored_file(label, dpi, fmt):
+    """The label's own file if it already is the requested rendition, else None."""
+    if dpi != NATIVE_DPI:
+        return None
+    if fmt == 'png' and label.image and label.image_hash:
+        return label.image
+    if fmt == 'tiff' and label.print_image and label.print_key == print_options_key():
+        return label.print_image
+    return None
+
+
+def label_rendition(label, dpi=NATIVE_DPI, fmt='png'):
+    """Return (path, etag, cached) of label rendered at dpi in fmt, rendering it on a cache miss."""
+    stored = _stored_file(label, dpi, fmt)
+    if stored is not None and os.path.exists(stored.path):
+        return stored.path, label.image_hash if fmt == 'png' else f'{label.image_hash}-{label.print_key}', True
+
+    barcode_path = barcode_paths([label.gtin]).get(label.gtin)
+    key = rendition_key(label_fingerprint(label, barcode_path, dpi=dpi), dpi, fmt)
+    path = rendition_path(key, fmt)
+    try:
+        # The mtime is the cache's recency
+        os.utime(path)
+        return path, key, True
+    except FileNotFoundError:
+        pass
+
+    data = rendition_bytes(label, barcode_path, dpi, fmt)
+    atomic_write(path, data)
+    _written(len(data))
+    return path, key, False
+
+
+def _written(size):
+    global _written_since_check
+    limit = cache_limit()
+    with _lock:
+        due = _written_since_check is None or _written_since_check + size >= limit // 20
+        _written_since_check = 0 if due else _written_since_check + size
+    if due:
+        evict_renditions(limit)
+
+
+def evict_renditions(limit=None):
+    """Delete the least recently used renditions while the cache is over limit; return how many."""
+    if limit is None:
+        limit = cache_limit()
+    files = []
+    total = 0
+    try:
+        shards = [entry.path for entry in os.scandir(rendition_dir()) if entry.is_dir()]
+    except FileNotFoundError:
+        return 0
+    for shard in shards:
+        try:
+            entries = list(os.scandir(shard))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name.endswith(PARTIAL_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    if total <= limit:
+        return 0
+
+    removed = 0
+    target = limit * LOW_WATER
+    for _, size, path in sorted(files):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    logger.info("Rendition cache: evicted %s files, %s bytes left", removed, total)
+    return removed
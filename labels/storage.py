@@ -1,10 +1,39 @@
 import os
+import uuid
+from contextlib import contextmanager
 from django.core.files.storage import FileSystemStorage
 
+# Files being written end in this until they are complete
+PARTIAL_SUFFIX = '.part'
+
 class OverwriteStorage(FileSystemStorage):
     """Storage that overwrites existing files instead of renaming them."""
     def get_available_name(self, name, max_length=None):
         # If the file exists, remove it before saving a new one
         if self.exists(name):
             os.remove(os.path.join(self.location, name))
-        return name
\ No newline at end of file
+        return name
+
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temporary path to write path's content to; it replaces path if the block completes.
+
+    Readers only ever see complete files. The temporary name is unique per
+    call, so threads or processes writing the same file at once don't write
+    into each other's, and it is removed if the block fails.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}'
+    try:
+        yield partial
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def atomic_write(path, data):
+    """Write data to path through atomic_path."""
+    with atomic_path(path) as partial, open(partial, 'wb') as f:
+        f.write(data)
@@ -1,3 +1,490 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.utils import timezone
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from .barcode_library import store_barcode
+from .export_cache import export_cache_key
+from .barcodes import is_valid_gtin
+from .csv_reader import CSVRowReader
+from . import render_cache
+from .jobs import claim_next_job, enqueue_job, run_job
+from .models import Barcode, CSVUpload, LabelJob, ProductLabel, RenderedLabel
+from .pagination import encode_cursor, keyset_page
+from .utils import process_csv, stream_zip_export
 
-# Create your tests here.
+HEADER = ['ProductName', 'MRP', 'Quality', 'Size', 'Net Quantity', 'Product Code', 'Design / Color',
+          'Mth & Year of Mfg.', 'GTINs']
+
+
+def label_rows(count):
+    return [
+        {
+            'ProductName': f'Cotton Bath Towel {n}', 'MRP': f'Rs. {499 + n}', 'Quality': 'Premium',
+            'Size': '70 x 140 cm', 'Net Quantity': '1 N', 'Product Code': f'TRS-{n:03d}',
+            'Design / Color': 'Blue / Stripes', 'Mth & Year of Mfg.': 'Oct 2025', 'GTINs': '8901234567005',
+        }
+        for n in range(count)
+    ]
+
+
+def csv_bytes(rows, encoding='utf-8'):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=[*HEADER, 'Copies'], extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue().encode(encoding)
+
+
+class MediaRootTestCase(TestCase):
+    """Writes MEDIA_ROOT to a temporary directory that is removed afterwards."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp(prefix='labels_tests_')
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=cls.media_root))
+        super().setUpClass()
+
+    def media_files(self):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(self.media_root) for name in names)
+
+
+class RenderApiTests(MediaRootTestCase):
+
+    def setUp(self):
+        User.objects.create_user('api', password='secret')
+        self.client = Client(enforce_csrf_checks=True)
+        self.auth = {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(b'api:secret').decode()}
+        self.url = reverse('render_api')
+
+    def post_json(self, rows, query='', **extra):
+        return self.client.post(self.url + query, json.dumps(rows), content_type='application/json', **extra)
+
+    def zip_names(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_requires_credentials(self):
+        response = self.post_json(label_rows(1))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm="labels"')
+
+        wrong = {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(b'api:wrong').decode()}
+        self.assertEqual(self.post_json(label_rows(1), **wrong).status_code, 401)
+
+    def test_session_callers_need_csrf_token(self):
+        self.client.login(username='api', password='secret')
+        self.assertEqual(self.post_json([]).status_code, 403)
+
+        self.client.get(reverse('upload_csv'))
+        token = self.client.cookies['csrftoken'].value
+        self.assertEqual(self.post_json([], HTTP_X_CSRFTOKEN=token).status_code, 200)
+
+    def test_json_rows(self):
+        rows = label_rows(3)
+        rows[1]['Copies'] = 'lots'
+        archive = self.zip_names(self.post_json({'rows': rows}, **self.auth))
+        self.assertEqual(archive.namelist(), ['label_00001_TRS-000.png', 'label_00003_TRS-002.png', 'errors.txt'])
+        self.assertEqual(archive.read('errors.txt').decode(), "Row 2: Copies must be a whole number, not 'lots'\n")
+        self.assertEqual(archive.read('label_00001_TRS-000.png')[:8], b'\x89PNG\r\n\x1a\n')
+
+    def test_csv_body(self):
+        response = self.client.post(self.url + '?format=tiff', csv_bytes(label_rows(2), 'cp1252'),
+                                    content_type='text/csv; charset=cp1252', **self.auth)
+        archive = self.zip_names(response)
+        self.assertEqual(archive.namelist(), ['label_00001_TRS-000.tif', 'label_00002_TRS-001.tif'])
+        self.assertIn(archive.read('label_00001_TRS-000.tif')[:4], (b'II*\x00', b'MM\x00*'))
+
+    def test_multipart_upload(self):
+        upload = ContentFile(csv_bytes(label_rows(2)), name='rows.csv')
+        archive = self.zip_names(self.client.post(self.url, {'file': upload}, **self.auth))
+        self.assertEqual(len(archive.namelist()), 2)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post_json([], '?format=gif', **self.auth).status_code, 400)
+        response = self.client.post(self.url, '{"rows": ', content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, '<rows/>', content_type='application/xml', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.generic('POST', self.url, b'ProductName\n', content_type='text/csv; charset=klingon',
+                                       **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+    def test_pdf_counts_skipped_rows(self):
+        rows = label_rows(3)
+        rows[0]['Copies'] = 4
+        rows[2]['Copies'] = -1
+        response = self.post_json(rows, '?output=pdf&mode=vector', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['X-Skipped-Rows'], '1')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF-'))
+
+    @override_settings(LABEL_RENDER_API_MAX_COPIES=5)
+    def test_copies_are_capped(self):
+        rows = label_rows(2)
+        rows[0]['Copies'] = 3
+        rows[1]['Copies'] = 3
+        response = self.post_json(rows, '?output=pdf', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'At most 5 copies', response.content)
+
+    def test_saves_nothing(self):
+        rows = label_rows(2)
+        b''.join(self.post_json(rows, **self.auth).streaming_content)
+        b''.join(self.post_json(rows, '?output=pdf', **self.auth).streaming_content)
+        self.assertFalse(ProductLabel.objects.exists())
+        self.assertFalse(CSVUpload.objects.exists())
+        self.assertFalse(RenderedLabel.objects.exists())
+        self.assertEqual(self.media_files(), [])
+
+
+class RenderLabelTests(MediaRootTestCase):
+
+    def setUp(self):
+        csv_upload = CSVUpload()
+        csv_upload.file.save('labels.csv', ContentFile(csv_bytes(label_rows(1))))
+        process_csv(csv_upload)
+        self.label = csv_upload.labels.get()
+        self.url = reverse('render_label', args=[self.label.id])
+
+    def test_stored_image_at_native_dpi(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        with self.label.image.open('rb') as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
+
+    def test_bad_parameters(self):
+        for query in ('?dpi=10', '?dpi=2000', '?dpi=abc', '?format=gif'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(self.url + query).status_code, 400)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url + '?dpi=72&format=webp')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url + '?dpi=72&format=webp', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_filename_is_cleaned(self):
+        ProductLabel.objects.filter(id=self.label.id).update(product_code='TRS "1"\r\nX-Injected: 1')
+        response = self.client.get(self.url + '?dpi=72')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="label_TRS_1X-Injected_1_72dpi.png"')
+
+
+class CSVRowReaderTests(SimpleTestCase):
+    TEXT = 'ProductName,MRP\nCrème Brûlée Towel,€ 499\nPlain Towel,299\n'
+
+    def read(self, data, **kwargs):
+        reader = CSVRowReader(io.BytesIO(data), **kwargs)
+        with self.assertLogs('labels.csv_reader', 'INFO'):
+            return reader, list(reader)
+
+    def assertRows(self, rows, expected):
+        self.assertEqual([(row_number, row) for row_number, row, _ in rows], list(enumerate(expected)))
+        self.assertEqual([error for _, _, error in rows], [None] * len(expected))
+
+    def test_detects_encodings(self):
+        expected = [{'ProductName': 'Crème Brûlée Towel', 'MRP': '€ 499'}, {'ProductName': 'Plain Towel', 'MRP': '299'}]
+        for encoding, detected in (('utf-8', 'utf-8-sig'), ('utf-8-sig', 'utf-8-sig'), ('cp1252', 'cp1252'),
+                                   ('utf-16', 'utf_16')):
+            with self.subTest(encoding=encoding):
+                reader, rows = self.read(self.TEXT.encode(encoding))
+                self.assertEqual(reader.encoding, detected)
+                self.assertRows(rows, expected)
+
+    def test_stray_cp1252_bytes_in_utf8(self):
+        data = 'ProductName,MRP\n'.encode() + ''.join(f'Crème Towel {n},₹ 499\n' for n in range(20)).encode()
+        reader, rows = self.read(data + b'Caf\xe9 Towel,299\n')
+        self.assertEqual(reader.encoding, 'utf-8-sig')
+        self.assertEqual(rows[-1], (20, {'ProductName': 'Café Towel', 'MRP': '299'}, None))
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        reader, rows = self.read(b'ProductName,MRP\nExtra,1,2\nShort\nGood,3\n')
+        self.assertEqual([row_number for row_number, _, _ in rows], [0, 1, 2])
+        self.assertIsNone(rows[0][1])
+        self.assertEqual(str(rows[0][2]), 'Line 2: 1 more value(s) than there are columns')
+        self.assertEqual(rows[1][1:], ({'ProductName': 'Short', 'MRP': ''}, None))
+        self.assertEqual(rows[2][1:], ({'ProductName': 'Good', 'MRP': '3'}, None))
+
+    def test_undecodable_characters(self):
+        reader, rows = self.read(b'ProductName,MRP\n\x81Towel,1\nTowel,2\n', encoding='cp1252')
+        self.assertIsNone(rows[0][1])
+        self.assertEqual(str(rows[0][2]), "Line 2: contains characters that aren't valid cp1252")
+        self.assertEqual(rows[1][1:], ({'ProductName': 'Towel', 'MRP': '2'}, None))
+
+    def test_given_encoding_skips_detection(self):
+        reader, rows = self.read(self.TEXT.encode('cp1252'), encoding='latin-1')
+        self.assertEqual(reader.encoding, 'latin-1')
+        self.assertEqual(rows[0][1]['MRP'], '\x80 499')
+
+    def test_leaves_open_files_open(self):
+        f = io.BytesIO(self.TEXT.encode())
+        with self.assertLogs('labels.csv_reader', 'INFO'):
+            list(CSVRowReader(f))
+        self.assertFalse(f.closed)
+
+    def test_reads_paths(self):
+        with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as f:
+            f.write(self.TEXT.encode('cp1252'))
+        self.addCleanup(os.remove, f.name)
+        with self.assertLogs('labels.csv_reader', 'INFO') as logs:
+            rows = list(CSVRowReader(f.name))
+        self.assertEqual(logs.records[0].getMessage(), f'Reading {os.path.basename(f.name)} as cp1252')
+        self.assertEqual(len(rows), 2)
+
+
+class KeysetPageTests(TestCase):
+    KEYS = ('-uploaded_at', '-id')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.uploads = [CSVUpload.objects.create(file=f'uploads/{n}.csv') for n in range(7)]
+        # Newest first, with ties on uploaded_at broken by id
+        cls.expected = sorted(cls.uploads, key=lambda upload: (upload.uploaded_at, upload.id), reverse=True)
+
+    def page(self, **cursors):
+        return keyset_page(CSVUpload.objects.all(), self.KEYS, 3, **cursors)
+
+    def test_pages_forward_and_back(self):
+        pages = [self.page()]
+        while pages[-1].has_next:
+            pages.append(self.page(after=pages[-1].next_cursor))
+        self.assertEqual([list(page) for page in pages],
+                         [self.expected[:3], self.expected[3:6], self.expected[6:]])
+        self.assertEqual([(page.has_previous, page.has_next) for page in pages],
+                         [(False, True), (True, True), (True, False)])
+        self.assertIsNone(pages[0].previous_cursor)
+        self.assertIsNone(pages[-1].next_cursor)
+
+        back = self.page(before=pages[-1].previous_cursor)
+        self.assertEqual(list(back), self.expected[3:6])
+        back = self.page(before=back.previous_cursor)
+        self.assertEqual(list(back), self.expected[:3])
+        self.assertFalse(back.has_previous)
+
+    def test_invalid_cursors_give_first_page(self):
+        upload = self.expected[2]
+        cursors = [
+            'not base64!', 'bm90IGpzb24', encode_cursor({'id': upload.id}), encode_cursor([upload.id]),
+            encode_cursor(['not a date', upload.id]), encode_cursor([upload.uploaded_at, '1 OR 1=1']),
+            encode_cursor([None, upload.id]), encode_cursor([{'$gt': ''}, upload.id]),
+        ]
+        for cursor in cursors:
+            for direction in ('after', 'before'):
+                with self.subTest(cursor=cursor, direction=direction):
+                    page = self.page(**{direction: cursor})
+                    self.assertEqual(list(page), self.expected[:3])
+                    self.assertFalse(page.has_previous)
+
+    def test_forged_cursor_seeks_from_its_values(self):
+        # A hand-made cursor can only choose where the page starts
+        upload = self.expected[1]
+        page = self.page(after=encode_cursor([upload.uploaded_at, upload.id]))
+        self.assertEqual(list(page), self.expected[2:5])
+
+
+class GTINTests(SimpleTestCase):
+
+    def test_valid(self):
+        for gtin in ('96385074', '4006381333931', '8901234567005', '10012345678902', '00000000000000'):
+            with self.subTest(gtin=gtin):
+                self.assertTrue(is_valid_gtin(gtin))
+
+    def test_wrong_check_digit(self):
+        for gtin in ('96385075', '4006381333930', '4006381333932', '10012345678900', '10012345678909'):
+            with self.subTest(gtin=gtin):
+                self.assertFalse(is_valid_gtin(gtin))
+
+    def test_not_a_gtin(self):
+        # UPC-A (12 digits) has to be given as its EAN-13, with a leading 0
+        for gtin in ('', '123456789012', '400638133393', '400638133393101', ' 4006381333931', '400638133393X',
+                     '4006-381333931', '٤٠٠٦٣٨١٣٣٣٩٣1', '²²²²²²²²²²²²0'):
+            with self.subTest(gtin=gtin):
+                self.assertFalse(is_valid_gtin(gtin))
+
+
+class RegenerateTests(MediaRootTestCase):
+
+    def setUp(self):
+        self.csv_upload = CSVUpload()
+        self.csv_upload.file.save('labels.csv', ContentFile(csv_bytes(label_rows(2))))
+        process_csv(self.csv_upload)
+
+    def test_missing_files_are_rendered_again(self):
+        label = self.csv_upload.labels.order_by('row_number').first()
+        with label.image.open('rb') as f:
+            image = f.read()
+        os.remove(label.image.path)
+
+        # A plain sync only looks at what changed in the CSV
+        process_csv(self.csv_upload)
+        self.assertFalse(os.path.exists(label.image.path))
+
+        run_job(enqueue_job(self.csv_upload, LabelJob.REGENERATE))
+        label.refresh_from_db()
+        with label.image.open('rb') as f:
+            self.assertEqual(f.read(), image)
+        self.assertEqual(self.csv_upload.labels.count(), 2)
+
+
+class MissingFileTests(MediaRootTestCase):
+
+    def setUp(self):
+        self.csv_upload = CSVUpload()
+        self.csv_upload.file.save('labels.csv', ContentFile(csv_bytes(label_rows(2))))
+        process_csv(self.csv_upload)
+        self.label = self.csv_upload.labels.order_by('row_number').first()
+        with self.label.image.open('rb') as f:
+            self.image = f.read()
+        os.remove(self.label.image.path)
+
+    def test_cache_entries_without_files_are_rendered_again(self):
+        other_upload = CSVUpload()
+        other_upload.file.save('other.csv', ContentFile(csv_bytes(label_rows(2))))
+        process_csv(other_upload)
+        label = other_upload.labels.order_by('row_number').first()
+        self.assertEqual(label.rendered_id, self.label.rendered_id)
+        with label.image.open('rb') as f:
+            self.assertEqual(f.read(), self.image)
+
+    def test_zip_export_draws_missing_images(self):
+        with self.assertLogs('labels.utils', 'WARNING'):
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip_export(self.csv_upload))))
+        self.assertEqual(archive.namelist(), ['label_TRS-000.tif', 'label_TRS-001.tif'])
+        self.assertIn(archive.read('label_TRS-000.tif')[:4], (b'II*\x00', b'MM\x00*'))
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.csv_upload = CSVUpload.objects.create(file='uploads/labels.csv')
+        self.other_upload = CSVUpload.objects.create(file='uploads/other.csv')
+
+    def finish(self, job):
+        LabelJob.objects.filter(id=job.id).update(status=LabelJob.DONE)
+
+    def test_one_running_job_per_upload(self):
+        process = enqueue_job(self.csv_upload, LabelJob.PROCESS)
+        regenerate = enqueue_job(self.csv_upload, LabelJob.REGENERATE)
+        other = enqueue_job(self.other_upload, LabelJob.PROCESS)
+
+        self.assertEqual(claim_next_job(), process)
+        # The regeneration waits for the upload's running job; other uploads don't
+        self.assertEqual(claim_next_job(), other)
+        self.assertIsNone(claim_next_job())
+
+        self.finish(process)
+        self.assertEqual(claim_next_job(), regenerate)
+
+    def test_job_queued_while_running_waits(self):
+        running = enqueue_job(self.csv_upload, LabelJob.REGENERATE)
+        self.assertEqual(claim_next_job(), running)
+
+        queued = enqueue_job(self.csv_upload, LabelJob.REGENERATE)
+        self.assertNotEqual(queued, running)
+        self.assertIsNone(claim_next_job())
+        self.finish(running)
+        self.assertEqual(claim_next_job(), queued)
+
+    def test_queued_jobs_are_reused(self):
+        regenerate = enqueue_job(self.csv_upload, LabelJob.REGENERATE)
+        self.assertEqual(enqueue_job(self.csv_upload, LabelJob.REGENERATE), regenerate)
+        # A queued regeneration already does what processing would
+        self.assertEqual(enqueue_job(self.csv_upload, LabelJob.PROCESS), regenerate)
+        self.assertEqual(self.csv_upload.jobs.count(), 1)
+
+
+class BarcodeLibraryTests(MediaRootTestCase):
+    GTIN = '8901234567005'
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.barcode, _ = store_barcode(self.GTIN, ContentFile(b'old image', name=f'EAN_{self.GTIN}.png'))
+        self.old_path = self.barcode.image.path
+
+    def test_replaced_file_is_deleted_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            barcode, changed = store_barcode(self.GTIN, ContentFile(b'new image', name=f'EAN_{self.GTIN}.png'))
+        self.assertTrue(changed)
+        self.assertFalse(os.path.exists(self.old_path))
+        with barcode.image.open('rb') as f:
+            self.assertEqual(f.read(), b'new image')
+
+    def test_rollback_keeps_replaced_file(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                store_barcode(self.GTIN, ContentFile(b'new image', name=f'EAN_{self.GTIN}.png'))
+                raise RuntimeError
+        barcode = Barcode.objects.get(gtin=self.GTIN)
+        self.assertEqual(barcode.image.path, self.old_path)
+        self.assertTrue(os.path.exists(self.old_path))
+
+
+class CollectUnusedRendersTests(MediaRootTestCase):
+
+    def setUp(self):
+        storage = RenderedLabel.image.field.storage
+        last_used = timezone.now() - timedelta(days=1)
+        self.entries = []
+        for n in range(3):
+            fingerprint = f'{n:064d}'
+            name = storage.save(render_cache.cas_name(fingerprint, 'png'), ContentFile(b'label'))
+            self.entries.append(RenderedLabel.objects.create(
+                fingerprint=fingerprint, image=name, image_hash='', last_used_at=last_used,
+            ))
+
+    def test_entry_attached_during_collection_doesnt_stop_it(self):
+        busy = self.entries[1]
+        delete_unused = render_cache._delete_unused
+
+        def attached_meanwhile(ids, cutoff):
+            if busy.id in ids:
+                raise ProtectedError('attached meanwhile', set())
+            return delete_unused(ids, cutoff)
+
+        with mock.patch.object(render_cache, '_delete_unused', side_effect=attached_meanwhile), \
+                self.assertLogs('labels.render_cache', 'INFO'):
+            self.assertEqual(render_cache.collect_unused_renders(batch_size=10), 2)
+        self.assertEqual(list(RenderedLabel.objects.all()), [busy])
+        self.assertEqual(self.media_files(), [busy.image.path])
+
+
+class ExportCacheKeyTests(TestCase):
+
+    def setUp(self):
+        self.csv_upload = CSVUpload.objects.create(file='uploads/labels.csv')
+        # Not rendered yet: no image, but vector PDFs still draw it
+        self.label = ProductLabel.objects.create(
+            csv_upload=self.csv_upload, product_name='Cotton Bath Towel', mrp='Rs. 499', net_quantity='1 N',
+            product_code='TRS-000', design_color='Blue', mfg_month='Oct', mfg_year='2025', gtin='8901234567005',
+            manufacturer='Maker',
+        )
+
+    def keys(self):
+        return export_cache_key(self.csv_upload, 'pdf', {'mode': 'raster'}), \
+            export_cache_key(self.csv_upload, 'pdf', {'mode': 'vector'}, every_label=True)
+
+    def test_vector_key_covers_labels_without_images(self):
+        raster, vector = self.keys()
+        ProductLabel.objects.filter(id=self.label.id).update(product_name='Cotton Hand Towel')
+        new_raster, new_vector = self.keys()
+        self.assertEqual(new_raster, raster)
+        self.assertNotEqual(new_vector, vector)
+
+        ProductLabel.objects.filter(id=self.label.id).update(copies=3)
+        self.assertNotEqual(self.keys()[1], new_vector)
@@ -4,7 +4,12 @@ from . import views
 urlpatterns = [
     path('', views.upload_csv, name='upload_csv'),
     path('labels/<int:upload_id>/', views.label_list, name='label_list'),
+    path('label/<int:label_id>/preview/', views.label_preview, name='label_preview'),
+    path('label/<int:label_id>/render/', views.render_label, name='render_label'),
     path('export/zip/<int:upload_id>/', views.export_zip, name='export_zip'),
     path('export/pdf/<int:upload_id>/', views.export_pdf, name='export_pdf'),
+    path('api/render/', views.render_api, name='render_api'),
     path('regenerate/<int:upload_id>/', views.regenerate_labels, name='regenerate_labels'),
+    path('jobs/<int:upload_id>/status/', views.job_status, name='job_status'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,379 +1,948 @@
-import csv
+import hashlib
 import io
+import json
+import logging
 import os
+import time
+import weakref
 import zipfile
-from PIL import Image, ImageDraw, ImageFont
+from collections import namedtuple
+from functools import lru_cache
+from PIL import Image, ImageChops, ImageColor, ImageDraw
 from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
 from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import get_valid_filename
 from .models import ProductLabel
-import barcode
-from barcode.writer import ImageWriter
-from reportlab.lib.pagesizes import letter
+from .fonts import font_registry, get_font, label_font_sizes
+from .render_pool import RenderPool, label_render_data
+from .export_cache import file_sha256, invalidate_export_cache
+from .csv_reader import MAX_ROW_ERRORS, CSVRowReader
+from .metrics import CSV_ROWS, EXPORT_BYTES, LABELS_RENDERED, RENDER_CACHE, observe_stage, timed
+from .cmyk import print_options_key, print_tiff_bytes, render_print_tiff
+from .previews import preview_bytes
+from .render_cache import attach, cached_renders, collect_unused_renders, store_renders, with_files
+from .barcodes import barcode_cache, fit_barcode_size, is_valid_gtin, synthesize_barcodes
+from .barcode_library import barcode_paths, upload_barcode_paths
+from .imposition import RasterLabelForms, VectorLabelForms, imposition_from_settings, label_placements
 from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
 
-def process_csv(csv_upload):
-    print("Process CSV called")
-    """Process CSV file and create ProductLabel instances (using uploaded barcode images)."""
+logger = logging.getLogger(__name__)
+
+def process_csv(csv_upload, workers=None, progress=None, repair=False):
+    """Process CSV file and sync its ProductLabel instances (using uploaded barcode images).
+
+    Every label stores a fingerprint of what its image was rendered from, so
+    processing an upload again only renders rows that are new or changed,
+    deletes labels whose rows are gone and leaves everything else untouched.
+
+    Rows are streamed from the file and committed a batch (LABEL_BULK_BATCH_SIZE
+    rows) per transaction, so memory use doesn't grow with the file. Each batch
+    is rendered by `workers` processes (LABEL_RENDER_WORKERS by default) while
+    the next one is written to the database. A sync that was interrupted is
+    resumed after its last committed batch the next time the upload is processed.
+    If given, progress(processed_rows, total_rows) is called as batches complete;
+    total_rows is an estimate until the whole file has been read.
+
+    With repair (regeneration), unchanged labels whose image file is missing
+    from storage are rendered again too, instead of being kept pointing at
+    nothing.
+    """
     file_path = csv_upload.file.path
+    manufacturer_text = MANUFACTURER_TEXT
+
+    # Rows that couldn't be read are reported on the upload instead of aborting it
+    rows = CSVRowReader(file_path)
+
+    resuming = csv_upload.sync_resume_row is not None
+    if resuming:
+        logger.info("Upload %s: resuming sync %s at row %s",
+                    csv_upload.id, csv_upload.sync_generation, csv_upload.sync_resume_row)
+    else:
+        csv_upload.sync_generation += 1
+        csv_upload.sync_resume_row = 0
+        csv_upload.row_errors = []
+        csv_upload.save(update_fields=['sync_generation', 'sync_resume_row', 'row_errors'])
+
+    try:
+        # Whatever an interrupted sync changed is unknown, so treat it as changed
+        changed = resuming
+
+        batches = _sync_batches(csv_upload, rows, manufacturer_text, repair)
+        # Print TIFFs are encoded with the PNGs, so ZIP exports only copy files
+        print_key = print_options_key() if render_print_tiff() else None
+        with RenderPool(workers, print_tiff=print_key is not None) as pool:
+            previous = None
+            for to_render, batch_changed, done_rows in batches:
+                changed = changed or batch_changed
+                # Labels whose content was rendered before, for any upload, reuse those files.
+                # Entries whose files are gone count as misses and are rendered again into
+                # the same files, which repairs every label sharing them.
+                cached = with_files(cached_renders(label.fingerprint for label, _ in to_render))
+                misses = _render_misses(to_render, cached)
+                # --- Generate label images (with or without barcode) ---
+                rendered = pool.submit((label_render_data(label), barcode_path) for label, barcode_path in misses)
+                if previous:
+                    _save_rendered(*previous, print_key=print_key, progress=progress, rows=rows)
+                previous = (to_render, cached, misses, rendered, done_rows)
+            if previous:
+                _save_rendered(*previous, print_key=print_key, progress=progress, rows=rows)
+
+        # --- Remove labels whose rows are gone ---
+        stale_count = _delete_stale_labels(csv_upload)
+        collect_unused_renders()
+        logger.info("Upload %s: synced %s rows, %s stale labels removed, %s rows skipped",
+                    csv_upload.id, csv_upload.sync_resume_row, stale_count, len(csv_upload.row_errors))
+        if changed or stale_count:
+            # Cached exports of the old label set are no longer needed
+            invalidate_export_cache(csv_upload)
+
+        total_rows = csv_upload.sync_resume_row
+        csv_upload.sync_resume_row = None
+        if progress:
+            progress(total_rows, total_rows)
+
+    except Exception as e:
+        logger.exception("Upload %s: couldn't complete label creation: %s", csv_upload.id, e)
+        raise
+    finally:
+        csv_upload.processed = True
+        csv_upload.encoding = rows.encoding or csv_upload.encoding
+        csv_upload.save()
+
+def _sync_batches(csv_upload, rows, manufacturer_text, repair=False):
+    """Commit the CSV a batch at a time, yielding ([(label, barcode path)] to render, changed, rows done)."""
+    batch_size = bulk_batch_size()
+    generation = csv_upload.sync_generation
+
+    # Labels an interrupted sync committed but didn't get to render
+    last_id = 0
+    while True:
+        unrendered = list(
+            csv_upload.labels.filter(sync_generation=generation, id__gt=last_id)
+            .filter(Q(image='') | Q(image__isnull=True)).order_by('id')[:batch_size]
+        )
+        if not unrendered:
+            break
+        last_id = unrendered[-1].id
+        barcode_map = barcode_paths(label.gtin for label in unrendered)
+        yield [(label, barcode_map.get(label.gtin)) for label in unrendered], False, None
+
+    batch = []
+    parse_start = time.perf_counter()
+    for row_number, row, error in rows:
+        if row_number < csv_upload.sync_resume_row:
+            continue
+        batch.append((row_number, row, error))
+        if len(batch) >= batch_size:
+            observe_stage('csv_parse', time.perf_counter() - parse_start)
+            yield _ingest_batch(csv_upload, batch, manufacturer_text, repair)
+            batch = []
+            parse_start = time.perf_counter()
+    if batch:
+        observe_stage('csv_parse', time.perf_counter() - parse_start)
+        yield _ingest_batch(csv_upload, batch, manufacturer_text, repair)
+
+def _ingest_batch(csv_upload, batch, manufacturer_text, repair=False):
+    """Diff a batch of CSV rows against the upload's labels and commit it in one transaction."""
+    generation = csv_upload.sync_generation
+    diff_start = time.perf_counter()
+    # The batch's barcodes, from the shared library in one query
+    barcode_map = barcode_paths(_row_gtin(row) for _, row, error in batch if error is None)
+    parsed = []
+    for row_number, row, error in batch:
+        if error is not None:
+            logger.debug("Skipping row: %s", error)
+            CSV_ROWS.inc(outcome='skipped')
+            if len(csv_upload.row_errors) < MAX_ROW_ERRORS:
+                csv_upload.row_errors.append(str(error))
+            continue
+
+        logger.debug("Processing product: %s", row.get('ProductName', ''))
+
+        try:
+            copies = parse_copies(row)
+        except ValueError as e:
+            CSV_ROWS.inc(outcome='skipped')
+            if len(csv_upload.row_errors) < MAX_ROW_ERRORS:
+                csv_upload.row_errors.append(f"Row {row_number + 1}: {e}")
+            continue
+
+        label = label_from_row(
+            row, manufacturer_text,
+            csv_upload=csv_upload, row_number=row_number, copies=copies, sync_generation=generation,
+        )
+        barcode_path = barcode_map.get(label.gtin)
+        label.fingerprint = label_fingerprint(label, barcode_path)
+        parsed.append((label, barcode_path))
+
+    # Labels from earlier syncs with the same fingerprints, not yet claimed by this one
+    candidates = {}
+    for label_id, fingerprint, row_number, copies, image in (
+        csv_upload.labels.filter(fingerprint__in={label.fingerprint for label, _ in parsed}, sync_generation__lt=generation)
+        .order_by('row_number', 'id').values_list('id', 'fingerprint', 'row_number', 'copies', 'image')
+    ):
+        candidates.setdefault(fingerprint, []).append((label_id, row_number, copies, image))
+
+    storage = ProductLabel.image.field.storage
+    labels_to_create = []
+    to_render = []
+    kept_ids = []
+    updated = []
+    kept_without_image = []
+    for label, barcode_path in parsed:
+        matches = candidates.get(label.fingerprint)
+        if matches:
+            # Unchanged row: keep the label, only follow it if the row moved or its
+            # copies changed (they don't change the image, so aren't in the fingerprint)
+            label_id, old_row_number, old_copies, image = matches.pop(0)
+            kept_ids.append(label_id)
+            if old_row_number != label.row_number or old_copies != label.copies:
+                updated.append(ProductLabel(id=label_id, row_number=label.row_number, copies=label.copies))
+            if not image or (repair and not storage.exists(image)):
+                kept_without_image.append((label_id, barcode_path))
+            continue
+
+        labels_to_create.append(label)
+        to_render.append((label, barcode_path))
+    observe_stage('diff', time.perf_counter() - diff_start)
+
+    with timed('db_write'), transaction.atomic():
+        if kept_ids:
+            ProductLabel.objects.filter(id__in=kept_ids).update(sync_generation=generation)
+        if updated:
+            ProductLabel.objects.bulk_update(updated, ['row_number', 'copies'])
+        ProductLabel.objects.bulk_create(labels_to_create)
+        csv_upload.sync_resume_row = batch[-1][0] + 1
+        csv_upload.save(update_fields=['sync_resume_row', 'row_errors'])
+
+    # Kept labels whose image never got saved (e.g. an interrupted run), or on repair whose
+    # file has gone missing, are rendered too
+    if kept_without_image:
+        kept = ProductLabel.objects.in_bulk([label_id for label_id, _ in kept_without_image])
+        to_render.extend((kept[label_id], barcode_path) for label_id, barcode_path in kept_without_image)
+
+    CSV_ROWS.inc(len(labels_to_create), outcome='created')
+    CSV_ROWS.inc(len(kept_ids), outcome='kept')
+
+    logger.debug("Sync: rows %s-%s, %s new or changed, %s moved or recounted",
+                 batch[0][0], batch[-1][0], len(labels_to_create), len(updated))
+    return to_render, bool(labels_to_create or updated), csv_upload.sync_resume_row
+
+def _render_misses(to_render, cached):
+    """The (label, barcode path) pairs to render: one per fingerprint the render cache lacks."""
+    misses = {}
+    for label, barcode_path in to_render:
+        if label.fingerprint not in cached and label.fingerprint not in misses:
+            misses[label.fingerprint] = (label, barcode_path)
+    RENDER_CACHE.inc(len(to_render) - len(misses), result='hit')
+    RENDER_CACHE.inc(len(misses), result='miss')
+    return list(misses.values())
+
+def _save_rendered(to_render, cached, misses, rendered, done_rows, print_key=None, progress=None, rows=None):
+    """Store a batch's new renders in the render cache and attach every label to its entry."""
+    entries = dict(cached)
+    entries.update(store_renders(
+        ((label.fingerprint, files) for (label, _), files in zip(misses, rendered)), print_key=print_key
+    ))
+    labels = []
+    for label, _ in to_render:
+        attach(label, entries[label.fingerprint])
+        labels.append(label)
+    if labels:
+        with timed('db_write'):
+            ProductLabel.objects.bulk_update(
+                labels, ['rendered', 'image', 'image_hash', 'preview', 'print_image', 'print_key']
+            )
+    if progress and done_rows is not None:
+        progress(done_rows, rows.estimate_rows(done_rows))
+
+def _delete_stale_labels(csv_upload):
+    """Delete, a batch at a time, the labels the latest sync didn't see; return how many."""
+    batch_size = bulk_batch_size()
+    stale = csv_upload.labels.filter(sync_generation__lt=csv_upload.sync_generation)
+    deleted = 0
+    while True:
+        chunk = list(stale.order_by('id').values_list('id', 'rendered_id', *LABEL_FILE_FIELDS)[:batch_size])
+        if not chunk:
+            return deleted
+        with timed('db_write'), transaction.atomic():
+            ProductLabel.objects.filter(id__in=[label_id for label_id, *_ in chunk]).delete()
+        for _, rendered_id, *names in chunk:
+            if rendered_id is not None:
+                # Shared render cache files, removed by collect_unused_renders()
+                continue
+            for field_name, name in zip(LABEL_FILE_FIELDS, names):
+                if name:
+                    ProductLabel._meta.get_field(field_name).storage.delete(name)
+        deleted += len(chunk)
+
+# ProductLabel file fields written when a label is rendered
+LABEL_FILE_FIELDS = ('image', 'preview', 'print_image')
+
+# Files rendered for one label; print_image is None unless print TIFFs are rendered
+LabelFiles = namedtuple('LabelFiles', ['image', 'preview', 'print_image'])
+
+# Bump when a change to the renderer alters the images it produces, so
+# existing labels are re-rendered on their next sync
+RENDER_VERSION = 1
+
+@lru_cache(maxsize=4096)
+def _barcode_file_hash(path, mtime_ns, size):
+    return file_sha256(path)
+
+def barcode_content_hash(gtin, barcode_path):
+    """Identify the barcode a label will be rendered with."""
+    if barcode_path and os.path.exists(barcode_path):
+        stat = os.stat(barcode_path)
+        return 'file:' + _barcode_file_hash(barcode_path, stat.st_mtime_ns, stat.st_size)
+    if synthesize_barcodes() and is_valid_gtin(gtin or ''):
+        return 'gtin:' + gtin
+    return ''
+
+def label_fingerprint(label, barcode_path, dpi=300):
+    """SHA-256 of every input of a label's image: its fields, the barcode, template, fonts and DPI."""
+    inputs = {
+        'fields': label_render_data(label),
+        'barcode': barcode_content_hash(label.gtin, barcode_path),
+        'template': LABEL_TEMPLATE,
+        'render_version': RENDER_VERSION,
+        'fonts': font_registry.fingerprint(),
+        'dpi': dpi,
+    }
+    if png_mode() != 'rgb':
+        # Only added for other modes, so RGB labels keep the fingerprints they had
+        inputs['png_mode'] = png_mode()
+    if render_print_tiff():
+        # Labels get re-rendered when print TIFFs are turned on or their profile changes
+        inputs['print'] = print_options_key()
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def label_from_row(row, manufacturer_text=None, **fields):
+    """Unsaved ProductLabel for a CSV row (column name -> value); fields sets the others, e.g. csv_upload."""
+    # Parse Mth & Year of Mfg. column
+    mfg_month, mfg_year = parse_mfg_date(row.get('Mth & Year of Mfg.', ''))
+    return ProductLabel(
+        product_name=row.get('ProductName', ''),
+        mrp=row.get('MRP', ''),
+        quality=row.get('Quality', ''),
+        size=row.get('Size', ''),
+        net_quantity=row.get('Net Quantity', ''),
+        product_code=row.get('Product Code', ''),
+        design_color=row.get('Design / Color', ''),
+        mfg_month=mfg_month,
+        mfg_year=mfg_year,
+        gtin=_row_gtin(row),
+        manufacturer=MANUFACTURER_TEXT if manufacturer_text is None else manufacturer_text,
+        **fields,
+    )
 
-    # Fixed manufacturer text
-    manufacturer_text = """Trisa Exports Pvt. Ltd. 
+def _row_gtin(row):
+    return str(row.get('GTINs') or row.get('GTIN') or '').strip()
+
+# Columns a row's print quantity is read from, the first one present wins
+COPIES_COLUMNS = ('Copies', 'Quantity to Print')
+MAX_COPIES = 10000
+
+def parse_copies(row):
+    """Times a row's label is printed, 1 when the row doesn't say; ValueError if it isn't a sensible count."""
+    value = next((str(row[column]).strip() for column in COPIES_COLUMNS if row.get(column)), '')
+    if not value:
+        return 1
+    try:
+        copies = int(float(value))
+    except (ValueError, OverflowError):
+        raise ValueError(f"Copies must be a whole number, not {value!r}") from None
+    if copies != float(value) or not 0 <= copies <= MAX_COPIES:
+        raise ValueError(f"Copies must be a whole number from 0 to {MAX_COPIES}, not {value!r}")
+    return copies
+
+def parse_mfg_date(mfg_date):
+    """Split a "Mth & Year of Mfg." value such as "Oct 2025" into (month, year)."""
+    parts = (mfg_date or '').split()
+    mfg_month = parts[0] if len(parts) > 0 else ''
+    mfg_year = parts[1] if len(parts) > 1 else ''
+    return mfg_month, mfg_year
+
+def filename_part(text, default='label'):
+    """text made safe to use in a file name or header (see get_valid_filename), or default if nothing is left."""
+    try:
+        return get_valid_filename(text)
+    except SuspiciousFileOperation:
+        return default
+
+def bulk_batch_size():
+    """Rows per bulk_create/bulk_update statement."""
+    return max(1, int(getattr(settings, 'LABEL_BULK_BATCH_SIZE', 500)))
+
+# Label template identifier, part of the skeleton cache key
+LABEL_TEMPLATE = 'trisa-2x3'
+
+# Define the font color
+FONT_COLOR = '#8B634B'  # (Pantone 876 C to hex conversion)
+
+# Bold captions of the label table, in drawing order
+FIELD_CAPTIONS = (
+    'Product :',
+    'MRP :',
+    'Quality :',
+    'Size :',
+    'Net Quantity :',
+    'Product Code :',
+    'Design / Color :',
+    'Mth & Year of Mfg. :',
+)
+MANUFACTURER_CAPTION = 'Manufactured and Marketed By :'
+
+# Fixed manufacturer text
+MANUFACTURER_TEXT = """Trisa Exports Pvt. Ltd. 
     E-2, Shree Arihant Compound, Ground Floor,
     Gala No. 1 to 8, Kalher, Bhiwandi,
     Thane - 421302, Maharashtra, India.
     For any concerns or issues, please
     Email us at support@trisa.co.in
     Call us at: +91 9156224974"""
+MAKE_IN_INDIA_TEXT = 'Make in India'
+
+# Entries per ramp of the indexed PNG palette, see label_palette()
+PALETTE_RAMP_STEPS = 128
+# Largest per-channel change quantising to the palette may make to a pixel
+PALETTE_TOLERANCE = 8
+PNG_MODES = ('rgb', 'palette')
+
+
+def png_mode():
+    """'rgb' for 24-bit label PNGs or 'palette' for indexed ones (LABEL_PNG_MODE)."""
+    mode = getattr(settings, 'LABEL_PNG_MODE', 'rgb')
+    return mode if mode in PNG_MODES else 'rgb'
+
+
+class LabelPalette:
+    """The fixed palette of palette-mode label PNGs and an exact mapping onto it.
+
+    A label only has white paper, the ink, the ink anti-aliased against white
+    and a black and white barcode, so the palette is a white-to-ink ramp
+    followed by a white-to-black ramp; white, ink and black are exact entries.
+    Pixels are placed on a ramp by the channel the ink darkens most, which is
+    exact for the template's colours, unlike Pillow's nearest-colour search.
+    """
+
+    def __init__(self, ink=FONT_COLOR, steps=PALETTE_RAMP_STEPS):
+        self.ink = ImageColor.getrgb(ink)
+        self.steps = steps
+        self.palette = []
+        for target in (self.ink, (0, 0, 0)):
+            for step in range(steps):
+                t = step / (steps - 1)
+                self.palette.extend(round(255 + (channel - 255) * t) for channel in target)
+
+        # Ink pixels differ between the lightest and darkest ink channel, greys don't
+        self.dark_channel = self.ink.index(min(self.ink))
+        self.light_channel = self.ink.index(max(self.ink))
+        ink_range = max(1, 255 - self.ink[self.dark_channel])
+        self.ink_lut = [round(min(1, (255 - v) / ink_range) * (steps - 1)) for v in range(256)]
+        self.grey_lut = [steps + round((255 - v) / 255 * (steps - 1)) for v in range(256)]
+        self.mask_lut = [255 if v else 0 for v in range(256)]
+
+        # id(image) -> fits(); images aren't hashable, entries go when the image does
+        self._fits = {}
+
+    def quantize(self, img):
+        """Map an RGB label onto the palette, returning a P image."""
+        dark, light = img.getchannel(self.dark_channel), img.getchannel(self.light_channel)
+        is_ink = ImageChops.subtract(light, dark).point(self.mask_lut)
+        index = Image.composite(dark.point(self.ink_lut), dark.point(self.grey_lut), is_ink)
+        quantized = Image.frombytes('P', img.size, index.tobytes())
+        quantized.putpalette(self.palette)
+        return quantized
+
+    def fits(self, img, tolerance=PALETTE_TOLERANCE):
+        """True if quantising img changes no pixel by more than tolerance; remembered per image."""
+        if id(img) in self._fits:
+            return self._fits[id(img)]
+        rgb = img if img.mode == 'RGB' else img.convert('RGB')
+        difference = ImageChops.difference(self.quantize(rgb).convert('RGB'), rgb)
+        fits = max(high for _, high in difference.getextrema()) <= tolerance
+        self._fits[id(img)] = fits
+        weakref.finalize(img, self._fits.pop, id(img), None)
+        return fits
+
+
+@lru_cache(maxsize=None)
+def label_palette(ink=FONT_COLOR):
+    return LabelPalette(ink)
+
+
+def stored_label_image(img, pasted=()):
+    """The rendered label converted to the mode its PNG is stored in.
+
+    pasted lists images pasted into the label that didn't come from the
+    template, e.g. an uploaded barcode. If one has colours the palette can't
+    hold, the label is kept as RGB rather than shown in the wrong colours.
+    """
+    palette = label_palette()
+    if img.mode == 'RGB' and png_mode() == 'palette' and all(palette.fits(pasted_img) for pasted_img in pasted):
+        return palette.quantize(img)
+    return img
+
+
+def encode_label_png(img, dpi=300, pasted=()):
+    """PNG bytes of a rendered label, in the configured mode and compression."""
+    return _png_bytes(stored_label_image(img, pasted), dpi)
+
+
+def _png_bytes(img, dpi):
+    output = io.BytesIO()
+    img.save(
+        output, format='PNG', dpi=(dpi, dpi),
+        compress_level=int(getattr(settings, 'LABEL_PNG_COMPRESS_LEVEL', 6)),
+        optimize=bool(getattr(settings, 'LABEL_PNG_OPTIMIZE', False)),
+    )
+    return output.getvalue()
+
+
+def _text_tile(width, height, draw_fn):
+    """Render draw_fn onto a white tile and crop it to the inked area.
+
+    Returns (tile, (dx, dy)) where (dx, dy) is the tile offset from the origin
+    draw_fn drew at, or (None, None) when nothing was drawn.
+    """
+    pad = 8
+    tile = Image.new('RGB', (width + 2 * pad, height + 2 * pad), color='white')
+    draw_fn(ImageDraw.Draw(tile), pad, pad)
+    bbox = ImageChops.difference(tile, Image.new('RGB', tile.size, color='white')).getbbox()
+    if bbox is None:
+        return None, None
+    return tile.crop(bbox), (bbox[0] - pad, bbox[1] - pad)
+
+
+class LabelSkeleton:
+    """Invariant layer of a label, rendered once and copied for every label.
+
+    The border and the "Make in India" footer sit at fixed positions and are
+    drawn straight onto the base image. The field captions and the
+    manufacturer block move with the wrapped value heights, so they are kept
+    as pre-rendered tiles that generate_label_image pastes at the right y.
+    """
+
+    def __init__(self, manufacturer, dpi=300, template=LABEL_TEMPLATE):
+        self.manufacturer = manufacturer
+        self.dpi = dpi
+        self.template = template
+
+        # Image dimensions: 2 inches x 3 inches
+        self.width = int(2 * dpi)
+        self.height = int(3 * dpi)
+
+        # Border and padding, designed at 300 DPI and scaled like the fonts
+        scale = dpi / 300
+        self.border_width = max(1, round(2 * scale))
+        self.border_padding_offset = round(15 * scale)
+        self.padding = round(20 * scale)
+        self.column_gap = round(8 * scale)
+
+        # --- Font setup (fonts are loaded once per process by the registry) ---
+        self.font_size, self.mii_font_size = label_font_sizes(dpi)
+        self.font_normal = get_font('regular', self.font_size)
+        self.font_bold = get_font('bold', self.font_size)
+        self.font_make_in_india = get_font('bold', self.mii_font_size)
+
+        # Content layout
+        self.x = self.border_padding_offset + self.border_width + self.padding
+        self.y = self.border_padding_offset + self.border_width + self.padding
+        self.line_height = int(self.font_size * 1.3)
+        self.row_padding = self.line_height // 3
+
+        self.table_width = self.width - 2 * self.x
+        self.label_column_width = int(self.table_width * 0.4)
+        self.value_column_x = self.x + self.label_column_width + self.column_gap
+        self.max_value_width = self.table_width - self.label_column_width - self.column_gap
+
+        self.base = self._render_base()
+        self.caption_tiles = {
+            caption: _text_tile(int(self.font_bold.getlength(caption)) + 1, self.line_height,
+                                self._caption_drawer(caption))
+            for caption in FIELD_CAPTIONS
+        }
+        self.manufacturer_lines = self._wrap_manufacturer()
+        self.manufacturer_height = self.line_height * (1 + len(self.manufacturer_lines))
+        self.manufacturer_tile = _text_tile(self.table_width, self.manufacturer_height, self.draw_manufacturer)
+
+    def _render_base(self):
+        img = Image.new('RGB', (self.width, self.height), color='white')
+        draw = ImageDraw.Draw(img)
+
+        # Draw border
+        draw.rectangle(
+            [(self.border_padding_offset, self.border_padding_offset),
+             (self.width - self.border_padding_offset, self.height - self.border_padding_offset)],
+            outline=FONT_COLOR,
+            width=self.border_width
+        )
+
+        # --- Bottom "Make in India" text position ---
+        mii_width = draw.textlength(MAKE_IN_INDIA_TEXT, font=self.font_make_in_india)
+        mii_text_height = self.mii_font_size + (self.line_height // 4)
+        self.x_mii_centered = (self.width - mii_width) / 2
+        bottom_content_y = self.height - (self.border_padding_offset + self.border_width + self.padding)
+        self.y_mii_start = bottom_content_y - mii_text_height
+
+        self.border_only = img.copy()
+        self.draw_footer(draw)
+        return img
+
+    def draw_footer(self, draw):
+        draw.text((self.x_mii_centered, self.y_mii_start), MAKE_IN_INDIA_TEXT,
+                  font=self.font_make_in_india, fill=FONT_COLOR)
+
+    def _caption_drawer(self, caption):
+        def draw_caption(draw, x, y):
+            draw.text((x, y), caption, font=self.font_bold, fill=FONT_COLOR)
+        return draw_caption
+
+    def _wrap_manufacturer(self):
+        lines = []
+        for part in self.manufacturer.split('\n'):
+            lines.extend(wrap_text(part, self.font_normal, self.width - 2 * self.x))
+        return lines
+
+    def draw_manufacturer(self, draw, x, y):
+        draw.text((x, y), MANUFACTURER_CAPTION, font=self.font_bold, fill=FONT_COLOR)
+        y += self.line_height
+        for line in self.manufacturer_lines:
+            draw.text((x, y), line, font=self.font_normal, fill=FONT_COLOR)
+            y += self.line_height
+
+    def fits(self, y_manufacturer):
+        """Whether a manufacturer block starting at y_manufacturer stays clear of the footer."""
+        image, offset = self.manufacturer_tile
+        if image is None:
+            return True
+        return y_manufacturer + offset[1] + image.height <= self.y_mii_start
+
+    def new_canvas(self, with_footer=True):
+        """Return a fresh copy of the base image for one label."""
+        if with_footer:
+            return self.base.copy()
+        return self.border_only.copy()
+
+    def paste_tile(self, img, tile, x, y):
+        image, offset = tile
+        if image is not None:
+            img.paste(image, (x + offset[0], y + offset[1]))
+
+
+@lru_cache(maxsize=16)
+def get_label_skeleton(manufacturer, dpi=300, template=LABEL_TEMPLATE):
+    """Return the cached LabelSkeleton for (template, dpi, manufacturer text)."""
+    return LabelSkeleton(manufacturer, dpi=dpi, template=template)
+
+
+class LabelLayout:
+    """Where everything goes on one label, shared by the raster and vector renderers.
+
+    All coordinates are in pixels at the skeleton's DPI, origin top-left.
+    """
+
+    def __init__(self, label, dpi=300):
+        skeleton = get_label_skeleton(label.manufacturer, dpi=dpi)
+        self.skeleton = skeleton
+        line_height = skeleton.line_height
+        y = skeleton.y
+
+        # Table data
+        table_data = [
+            label.product_name,
+            label.mrp,
+            label.quality,
+            label.size,
+            label.net_quantity,
+            label.product_code,
+            label.design_color,
+            f"{label.mfg_month} {label.mfg_year}".strip(),
+        ]
+
+        # Lay out the table; wrapped values push everything below them down
+        self.rows = []
+        for field_label, field_value in zip(FIELD_CAPTIONS, table_data):
+            value_lines = wrap_text(field_value, skeleton.font_normal, skeleton.max_value_width)
+            self.rows.append((field_label, y, value_lines))
+            y += line_height * max(1, len(value_lines))
+            y += skeleton.row_padding
+
+        y += int(line_height * 1.1)
+        self.y_manufacturer = y
+        y += skeleton.manufacturer_height
+
+        y += line_height // 2
+        self.y_barcode_block_start = y
+
+    def barcode_target_size(self):
+        """(width, height) of the box a barcode is fitted into."""
+        skeleton = self.skeleton
+        barcode_max_width = skeleton.width - 2 * skeleton.x
+        barcode_available_height = skeleton.y_mii_start - self.y_barcode_block_start
+        barcode_target_height = int(barcode_available_height * 1.0)
+        return barcode_max_width, barcode_target_height
+
+    def barcode_position(self, final_width, final_height):
+        """Top-left (x, y) that centres a final_width x final_height barcode in its box."""
+        skeleton = self.skeleton
+        barcode_max_width = skeleton.width - 2 * skeleton.x
+        x_centered = skeleton.x + (barcode_max_width - final_width) // 2
+        reserved_space_height = skeleton.y_mii_start - self.y_barcode_block_start
+        vertical_padding = (reserved_space_height - final_height) // 2
+        y_barcode_paste = self.y_barcode_block_start + vertical_padding
+        return x_centered, y_barcode_paste
+
+    def barcode_box(self, barcode_width, barcode_height):
+        """Return (x, y, width, height) for a barcode image of the given size, or None if it can't fit."""
+        final_width, final_height = fit_barcode_size(barcode_width, barcode_height, *self.barcode_target_size())
+        if final_width <= 0 or final_height <= 0:
+            return None
+        return (*self.barcode_position(final_width, final_height), final_width, final_height)
 
-    try:
-        # --- Detect encoding ---
-        try:
-            encoder = 'cp1252'
-            with open(file_path, mode='r', encoding=encoder) as f:
-                reader = csv.DictReader(f)
-                print(f"Testing encoder with {encoder} for Product: {next(reader).get('ProductName')}")
-                csv_upload.labels.all().delete()
-        except Exception:
-            encoder = 'utf-8'
-            with open(file_path, mode='r', encoding=encoder) as f:
-                reader = csv.DictReader(f)
-                print(f"Testing encoder with {encoder} for Product: {next(reader).get('ProductName')}")
-
-        # --- Build barcode lookup from uploaded files ---
-        barcode_map = {}
-        if hasattr(csv_upload, "barcodes"):
-            for barcode_obj in csv_upload.barcodes.all():
-                filename = os.path.basename(barcode_obj.image.name).lower()
-                if filename.startswith("ean_") and filename.endswith(".png"):
-                    gtin = filename[4:-4]  # extract GTIN from filename (EAN_<GTIN>.png)
-                    barcode_map[gtin] = barcode_obj.image.path
-
-        # --- Read CSV and create labels ---
-        with open(file_path, mode='r', encoding=encoder) as f:
-            print("Opened CSV for processing...")
-            reader = csv.DictReader(f)
-
-            for row in reader:
-                product_name = row.get('ProductName', '')
-                print(f"Processing product: {product_name}")
-
-                gtin = str(row.get('GTINs') or row.get('GTIN') or '').strip()
-                barcode_path = barcode_map.get(gtin.lower()) if gtin else None
-
-                label = ProductLabel.objects.create(
-                    csv_upload=csv_upload,
-                    product_name=product_name,
-                    mrp=row.get('MRP', ''),
-                    quality=row.get('Quality', ''),
-                    size=row.get('Size', ''),
-                    net_quantity=row.get('Net Quantity', ''),
-                    product_code=row.get('Product Code', ''),
-                    design_color=row.get('Design / Color', ''),
-                    mfg_month='',
-                    mfg_year='',
-                    gtin=gtin,
-                    manufacturer=manufacturer_text
-                )
-
-                # Parse Mth & Year of Mfg. column
-                mfg_date = row.get('Mth & Year of Mfg.', '')
-                if mfg_date:
-                    parts = mfg_date.split()
-                    label.mfg_month = parts[0] if len(parts) > 0 else ''
-                    label.mfg_year = parts[1] if len(parts) > 1 else ''
-                    label.save()
-
-                # --- Generate label image (with or without barcode) ---
-                image_file = generate_label_image(label, barcode_path=barcode_path)
-                label.image.save(f'label_{label.id}.png', image_file, save=True)
-
-    except Exception as e:
-        print(f"Couldn't complete label creation. Error: {e}")
-
-    csv_upload.processed = True
-    csv_upload.save()
 
 def generate_label_image(label, barcode_path=None):
     """Generate label image with specifications, improved margins, and bold labels."""
-    # Image dimensions: 2 inches x 3 inches at 300 DPI
-    dpi = 300
-    width = int(2 * dpi)  # 600 pixels
-    height = int(3 * dpi)  # 900 pixels
-
-    # Create RGB image
-    img = Image.new('RGB', (width, height), color='white')
-    draw = ImageDraw.Draw(img)
+    return ContentFile(render_label_files(label, barcode_path, preview=False).image)
 
-    # Define the font color
-    FONT_COLOR = '#8B634B'  # (Pantone 876 C to hex conversion)
-
-    # Border and padding
-    border_width = 2
-    border_padding_offset = 15
-    padding = 20
-
-    # Draw border
-    draw.rectangle(
-        [(border_padding_offset, border_padding_offset),
-         (width - border_padding_offset, height - border_padding_offset)],
-        outline=FONT_COLOR,
-        width=border_width
+def render_label_files(label, barcode_path=None, preview=True, print_tiff=False):
+    """Render a label once; return LabelFiles with its PNG and, as asked, its preview and print TIFF."""
+    dpi = 300
+    img, pasted = draw_label_image(label, barcode_path, dpi=dpi)
+    with timed('png_encode'):
+        # The print TIFF is encoded from the stored image, so it matches one made from the PNG
+        img = stored_label_image(img, pasted)
+        image_data = _png_bytes(img, dpi)
+    LABELS_RENDERED.inc()
+    return LabelFiles(
+        image_data,
+        preview_bytes(img) if preview else None,
+        print_tiff_bytes(img) if print_tiff else None,
     )
 
-    # --- Font setup ---
-    target_point_size = 6.5
-    visual_reduction_factor = 0.9
-    calculated_pixel_size = target_point_size * dpi / 72
-    font_size = int(calculated_pixel_size * visual_reduction_factor)
-    if font_size < 10:
-        font_size = 10
-
-    bold_font_path = None
-    try:
-        font_dir = os.path.join(settings.BASE_DIR, 'static', 'style', 'fonts', 'myriad-pro')
-        regular_font_path = os.path.join(font_dir, 'MYRIADPRO-REGULAR.OTF')
-        bold_font_path = os.path.join(font_dir, 'MYRIADPRO-BOLD.OTF')
-        font_normal = ImageFont.truetype(regular_font_path, font_size)
-        font_bold = ImageFont.truetype(bold_font_path, font_size)
-    except Exception as e:
-        print(f"Font load failed: {e}")
-        font_normal = ImageFont.load_default()
-        font_bold = ImageFont.load_default()
-
-    # Content layout
-    x = border_padding_offset + border_width + padding
-    y = border_padding_offset + border_width + padding
-    line_height = int(font_size * 1.3)
-    row_padding = line_height // 3
-
-    # Table data
-    table_data = [
-        ('Product :', label.product_name),
-        ('MRP :', label.mrp),
-        ('Quality :', label.quality),
-        ('Size :', label.size),
-        ('Net Quantity :', label.net_quantity),
-        ('Product Code :', label.product_code),
-        ('Design / Color :', label.design_color),
-        ('Mth & Year of Mfg. :', f"{label.mfg_month} {label.mfg_year}".strip())
-    ]
-
-    table_width = width - 2 * x
-    label_column_width = int(table_width * 0.4)
-    value_column_x = x + label_column_width + 8
+def draw_label_image(label, barcode_path=None, dpi=300):
+    """Draw a label; return the RGB image and the uploaded images pasted into it."""
+    # Image dimensions: 2 inches x 3 inches at 300 DPI
+    render_start = time.perf_counter()
+    layout = LabelLayout(label, dpi=dpi)
+    skeleton = layout.skeleton
+
+    font_normal = skeleton.font_normal
+    font_bold = skeleton.font_bold
+    x = skeleton.x
+    line_height = skeleton.line_height
+
+    # Start from the pre-rendered border and footer. If the content runs into
+    # the footer, draw the text directly and put the footer on top at the end.
+    use_tiles = skeleton.fits(layout.y_manufacturer)
+    img = skeleton.new_canvas(with_footer=use_tiles)
+    draw = ImageDraw.Draw(img)
 
     # Draw table
-    for field_label, field_value in table_data:
-        draw.text((x, y), field_label, font=font_bold, fill=FONT_COLOR)
-        max_value_width = table_width - label_column_width - 8
-        value_lines = wrap_text(field_value, font_normal, max_value_width)
+    for field_label, row_y, value_lines in layout.rows:
+        if use_tiles:
+            skeleton.paste_tile(img, skeleton.caption_tiles[field_label], x, row_y)
+        else:
+            draw.text((x, row_y), field_label, font=font_bold, fill=FONT_COLOR)
         for i, value_line in enumerate(value_lines):
-            draw.text((value_column_x, y + (i * line_height)),
+            draw.text((skeleton.value_column_x, row_y + (i * line_height)),
                       value_line, font=font_normal, fill=FONT_COLOR)
-        y += line_height * max(1, len(value_lines))
-        y += row_padding
-
-    y += int(line_height * 1.1)
 
     # Manufacturer info
-    draw.text((x, y), 'Manufactured and Marketed By :', font=font_bold, fill=FONT_COLOR)
-    y += line_height
-    manufacturer_parts = label.manufacturer.split('\n')
-    for part in manufacturer_parts:
-        wrapped_lines = wrap_text(part, font_normal, width - 2 * x)
-        for line in wrapped_lines:
-            draw.text((x, y), line, font=font_normal, fill=FONT_COLOR)
-            y += line_height
-
-    y += line_height // 2
-    y_barcode_block_start = y
-
-    # --- Bottom "Make in India" text ---
-    mii_text = "Make in India"
-    mii_font_size = int(font_size * 1.2)
-    font_make_in_india = font_bold
-    try:
-        if bold_font_path and os.path.exists(bold_font_path):
-            font_make_in_india = ImageFont.truetype(bold_font_path, mii_font_size)
-    except Exception:
-        pass
-
-    mii_width = draw.textlength(mii_text, font=font_make_in_india)
-    mii_text_height = mii_font_size + (line_height // 4)
-    x_mii_centered = (width - mii_width) / 2
-    bottom_content_y = height - (border_padding_offset + border_width + padding)
-    y_mii_start = bottom_content_y - mii_text_height
-    barcode_available_height = y_mii_start - y_barcode_block_start
-    barcode_target_height = int(barcode_available_height * 1.0)
+    if use_tiles:
+        skeleton.paste_tile(img, skeleton.manufacturer_tile, x, layout.y_manufacturer)
+    else:
+        skeleton.draw_manufacturer(draw, x, layout.y_manufacturer)
 
     # --- Paste barcode image if available ---
+    barcode_start = time.perf_counter()
+    pasted = []
     if barcode_path and os.path.exists(barcode_path):
         try:
-            barcode_img = Image.open(barcode_path)
-            if barcode_img.mode != 'RGB':
-                barcode_img = barcode_img.convert('RGB')
-
-            barcode_max_width = width - 2 * x
-            ratio = barcode_img.width / barcode_img.height
-            final_width = barcode_max_width
-            final_height = int(final_width / ratio)
-
-            if final_height > barcode_target_height:
-                final_height = barcode_target_height
-                final_width = int(final_height * ratio)
-
-            if final_width > 0 and final_height > 0:
-                barcode_img = barcode_img.resize((final_width, final_height), Image.Resampling.LANCZOS)
-                x_centered = x + (barcode_max_width - final_width) // 2
-                reserved_space_height = y_mii_start - y_barcode_block_start
-                vertical_padding = (reserved_space_height - final_height) // 2
-                y_barcode_paste = y_barcode_block_start + vertical_padding
-                img.paste(barcode_img, (x_centered, y_barcode_paste))
+            # Decoded and resized once per file and box size, see labels.barcodes
+            barcode_img = barcode_cache.get(barcode_path, *layout.barcode_target_size())
+            if barcode_img is not None:
+                img.paste(barcode_img, layout.barcode_position(barcode_img.width, barcode_img.height))
+                pasted.append(barcode_img)
         except Exception as e:
-            print(f"Failed to paste barcode image: {e}")
+            logger.warning("Failed to paste barcode image %s: %s", barcode_path, e)
+    elif synthesize_barcodes() and is_valid_gtin(label.gtin or ''):
+        # No uploaded image: draw the bars for the GTIN straight at the box size
+        barcode_img = barcode_cache.get_synthesized(label.gtin, *layout.barcode_target_size())
+        if barcode_img is not None:
+            img.paste(barcode_img, layout.barcode_position(barcode_img.width, barcode_img.height))
     else:
         # Leave empty space for barcode (do nothing)
         pass
+    barcode_seconds = time.perf_counter() - barcode_start
 
-    # --- Draw "Make in India" text ---
-    draw.text((x_mii_centered, y_mii_start), mii_text, font=font_make_in_india, fill=FONT_COLOR)
+    if not use_tiles:
+        skeleton.draw_footer(draw)
+    observe_stage('barcode_lookup', barcode_seconds)
+    observe_stage('render', time.perf_counter() - render_start - barcode_seconds)
+    return img, pasted
 
-    # Save to bytes
-    output = io.BytesIO()
-    img.save(output, format='PNG', dpi=(dpi, dpi))
-    output.seek(0)
-    return ContentFile(output.read())
+def get_text_width(text_to_measure, text_font):
+    """Width of text_to_measure in text_font, in pixels."""
+    # Use textlength to measure string width more accurately
+    if hasattr(text_font, 'getlength'):
+        return text_font.getlength(text_to_measure)
+    # Fallback for default font where getlength might not be available or accurate
+    return text_font.getsize(text_to_measure)[0]
+
+@lru_cache(maxsize=16384)
+def word_width(word, font):
+    """Cached width of a single word (or the space) in font, shared across labels.
+
+    Fonts come from the process-wide registry, so the same font object is
+    reused for every label and the cache stays warm for a whole batch.
+    """
+    return get_text_width(word, font)
 
 def wrap_text(text, font, max_width):
-    """Wrap text to fit within max_width, respecting explicit newline characters."""
+    """Wrap text to fit within max_width, respecting explicit newline characters.
+
+    Each word is measured once (see word_width) and line widths are summed
+    instead of re-measuring the whole candidate line for every word. Pair
+    kerning can make a joined line slightly narrower or wider than the sum of
+    its words, so when the sum lands within `slack` of max_width the
+    candidate line is measured exactly; the breaks are the same as measuring
+    every candidate line.
+    """
     if not text:
         return ['']
     
     final_lines = []
+    space_width = word_width(' ', font)
+    slack = max(2.0, getattr(font, 'size', 10) * 0.25)
     
     # First, split the text by explicit newline characters
-    segments = text.split('\n')
-    
-    # Use textlength to measure string width more accurately
-    def get_text_width(text_to_measure, text_font):
-        if hasattr(text_font, 'getlength'):
-            return text_font.getlength(text_to_measure)
-        # Fallback for default font where getlength might not be available or accurate
-        return text_font.getsize(text_to_measure)[0] 
-
-    for segment in segments:
-        words = segment.split()
+    for segment in text.split('\n'):
         current_line = []
+        current_width = 0
         
-        for word in words:
+        for word in segment.split():
+            width = word_width(word, font)
             if not current_line:
                 current_line.append(word)
+                current_width = width
+                continue
+
+            line_width = current_width + space_width + width
+            if abs(line_width - max_width) <= slack:
+                line_width = get_text_width(' '.join(current_line + [word]), font)
+
+            if line_width <= max_width:
+                current_line.append(word)
+                current_width = line_width
             else:
-                test_line = ' '.join(current_line + [word])
-                if get_text_width(test_line, font) <= max_width:
-                    current_line.append(word)
-                else:
-                    final_lines.append(' '.join(current_line))
-                    current_line = [word]
+                final_lines.append(' '.join(current_line))
+                current_line = [word]
+                current_width = width
         
         if current_line:
             final_lines.append(' '.join(current_line))
     
     return final_lines if final_lines else ['']
 
-# def generate_barcode(gtin):
-    """Generate barcode image from GTIN"""
-    try:
-        # Determine barcode type based on GTIN length
-        gtin = gtin.strip()
-        if len(gtin) == 13:
-            barcode_class = barcode.get_barcode_class('ean13')
-        elif len(gtin) == 8:
-            barcode_class = barcode.get_barcode_class('ean8')
-        elif len(gtin) == 14:
-            barcode_class = barcode.get_barcode_class('ean14')
-        else:
-            # Default to CODE128
-            barcode_class = barcode.get_barcode_class('code128')
-        
-        # Generate barcode
-        writer = ImageWriter()
-        writer.set_options({
-            'write_text': True,
-            'font_size': 8,
-            'module_height': 8,   # Reverted to a stable height; final scaling is now controlled in generate_label_image
-            'module_width': 0.1  
-        })
-        
-        barcode_instance = barcode_class(gtin, writer=writer)
-        output = io.BytesIO()
-        barcode_instance.write(output)
-        output.seek(0)
-        
-        return Image.open(output)
-    except Exception as e:
-        print(f"Barcode generation error: {e}")
-        return None
+class ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink for ZipFile that hands back the bytes written so far."""
 
-def create_zip_export(csv_upload):
-    """Create ZIP file with all label images"""
-    zip_path = os.path.join(settings.MEDIA_ROOT, f'export_{csv_upload.id}.zip')
-    
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for label in csv_upload.labels.all():
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def label_tiff_bytes(label, print_key=None):
+    """CMYK print TIFF of a label: its stored print image if current, else encoded in memory.
+
+    A label whose image file has gone missing is drawn again.
+    """
+    if print_key is None:
+        print_key = print_options_key()
+    if label.print_image and label.print_key == print_key:
+        try:
+            with timed('tiff_copy'), label.print_image.open('rb') as f:
+                return f.read()
+        except OSError:
+            pass
+    try:
+        with Image.open(label.image.path) as img:
+            img.load()
+            return print_tiff_bytes(img)
+    except FileNotFoundError:
+        # Exports stream, so a missing file is drawn again rather than cutting the download short
+        logger.warning("Label %s: image file %s is missing, rendering it again", label.id, label.image.name)
+    img, pasted = draw_label_image(label, barcode_paths([label.gtin]).get(label.gtin))
+    return print_tiff_bytes(stored_label_image(img, pasted))
+
+def stream_zip_export(csv_upload):
+    """Yield a ZIP of CMYK TIFFs for all label images, one label at a time.
+
+    Each TIFF is copied from the print image stored at render time, or
+    encoded in memory, and written to the archive as soon as it is ready, so
+    memory stays around one label. The colour transform is built once and
+    shared by every label (see labels.cmyk).
+    """
+    print_key = print_options_key()
+    stream = ZipStream()
+    size = 0
+    with zipfile.ZipFile(stream, 'w') as zipf:
+        for label in csv_upload.labels.all().iterator():
             if label.image:
-                # Convert to CMYK TIFF for print
-                img = Image.open(label.image.path)
-                cmyk_img = img.convert('CMYK')
-                
-                # Save as TIFF (supports CMYK)
-                tiff_path = os.path.join(settings.MEDIA_ROOT, f'temp_label_{label.id}.tif')
-                cmyk_img.save(tiff_path, format='TIFF', dpi=(300, 300))
-                
-                zipf.write(tiff_path, f'label_{label.product_code}.tif')
-                
-                # Clean up temp file
-                os.remove(tiff_path)
-    
-    return zip_path
+                zipf.writestr(f'label_{label.product_code}.tif', label_tiff_bytes(label, print_key))
+                chunk = stream.pop()
+                size += len(chunk)
+                yield chunk
+    # Central directory
+    chunk = stream.pop()
+    EXPORT_BYTES.inc(size + len(chunk), kind='zip')
+    yield chunk
+
+def create_pdf_export(csv_upload, pdf_path=None, mode='raster', imposition=None):
+    """Create PDF with all labels, each placed as many times as its row's copies.
+
+    mode 'raster' embeds each label's rendered PNG; mode 'vector' draws the
+    labels with reportlab text and lines, embedding each barcode once.
+    imposition (labels.imposition.Imposition) chooses the sheet, spacing and
+    crop marks; by default the LABEL_PDF_* settings.
+    """
+    if pdf_path is None:
+        pdf_path = os.path.join(settings.MEDIA_ROOT, f'export_{csv_upload.id}.pdf')
+    if imposition is None:
+        imposition = imposition_from_settings()
+
+    with timed(f'export_pdf_{mode}'):
+        _draw_pdf_export(csv_upload, pdf_path, mode, imposition)
+    EXPORT_BYTES.inc(os.path.getsize(pdf_path), kind=f'pdf_{mode}')
+    return pdf_path
 
-def create_pdf_export(csv_upload):
-    """Create PDF with all label images"""
-    pdf_path = os.path.join(settings.MEDIA_ROOT, f'export_{csv_upload.id}.pdf')
-    
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    page_width, page_height = letter
-    
-    # Calculate positions for labels (2" x 3" at 72 DPI for PDF)
-    label_width = 2 * 72  # 144 points
-    label_height = 3 * 72  # 216 points
-    
-    x_margin = 36  # 0.5 inch margin
-    y_margin = 36
-    
-    labels_per_row = int((page_width - 2 * x_margin) / label_width)
-    labels_per_col = int((page_height - 2 * y_margin) / label_height)
-    
-    x_pos = x_margin
-    y_pos = page_height - y_margin - label_height
-    count = 0
-    
-    for label in csv_upload.labels.all():
-        if label.image and os.path.exists(label.image.path):
-            img = ImageReader(label.image.path)
-            c.drawImage(img, x_pos, y_pos, width=label_width, height=label_height, preserveAspectRatio=True)
-            
-            count += 1
-            x_pos += label_width
-            
-            if count % labels_per_row == 0:
-                x_pos = x_margin
-                y_pos -= label_height
-                
-                if count % (labels_per_row * labels_per_col) == 0 and count < csv_upload.labels.count():
-                    c.showPage()
-                    y_pos = page_height - y_margin - label_height
-    
+def _draw_pdf_export(csv_upload, pdf_path, mode, imposition):
+    c = canvas.Canvas(pdf_path, pagesize=imposition.page_size)
+    label_width, label_height = imposition.label_width, imposition.label_height
+
+    if mode == 'vector':
+        from .vector_pdf import VectorLabelRenderer
+        forms = VectorLabelForms(VectorLabelRenderer(c, upload_barcode_paths(csv_upload)), label_width, label_height)
+        labels = csv_upload.labels.all()
+    else:
+        forms = RasterLabelForms(c, label_width, label_height)
+        labels = csv_upload.labels.exclude(image='').exclude(image__isnull=True)
+
+    imposition.impose(c, label_placements(labels.iterator(), forms))
     c.save()
-    return pdf_path
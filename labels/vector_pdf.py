@@ -0,0 +1,190 @@
+import logging
+from functools import lru_cache
+from PIL import Image
+from reportlab.lib.colors import HexColor
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from .barcodes import BarcodeSymbol, is_valid_gtin, synthesize_barcodes
+from .fonts import font_registry, get_font
+from .utils import FONT_COLOR, MAKE_IN_INDIA_TEXT, MANUFACTURER_CAPTION, LabelLayout
+
+logger = logging.getLogger(__name__)
+
+# Standard PDF fonts used when a face can't be embedded. reportlab only embeds
+# TrueType outlines and the bundled Myriad Pro files are CFF based.
+FALLBACK_PDF_FONTS = {
+    'regular': 'Helvetica',
+    'bold': 'Helvetica-Bold',
+}
+
+
+@lru_cache(maxsize=None)
+def pdf_font_name(face):
+    """Register the label font for face with reportlab, or fall back to a standard font."""
+    name = f'LabelFont-{face}'
+    try:
+        pdfmetrics.registerFont(TTFont(name, font_registry.font_path(face)))
+    except (TTFError, OSError):
+        return FALLBACK_PDF_FONTS[face]
+    return name
+
+
+class VectorLabelRenderer:
+    """Draw labels onto a reportlab canvas as text and lines instead of a raster image.
+
+    Positions come from the same LabelLayout generate_label_image uses, and
+    every line of text is stretched to the width Pillow measures for it, so
+    the PDF matches the PNG even when the PDF font differs from Myriad Pro.
+    Each distinct barcode image is embedded once as a form XObject; barcodes
+    synthesised from a GTIN are drawn as vector bars, also once per GTIN.
+    """
+
+    def __init__(self, canvas, barcode_map=None, dpi=300):
+        self.canvas = canvas
+        self.barcode_map = barcode_map or {}
+        self.dpi = dpi
+        self.ink = HexColor(FONT_COLOR)
+        self._barcode_forms = {}
+        self._synthesized_forms = {}
+
+    def _barcode_form(self, gtin):
+        """Return (form name, pixel width, pixel height) for gtin's barcode, or None."""
+        gtin = gtin.lower()
+        if gtin in self._barcode_forms:
+            return self._barcode_forms[gtin]
+
+        form = None
+        barcode_path = self.barcode_map.get(gtin)
+        if barcode_path:
+            try:
+                with Image.open(barcode_path) as barcode_img:
+                    size = barcode_img.size
+                name = f'barcode_{len(self._barcode_forms)}'
+                # A unit square form, scaled into each label's barcode box
+                self.canvas.beginForm(name, lowerx=0, lowery=0, upperx=1, uppery=1)
+                self.canvas.drawImage(barcode_path, 0, 0, width=1, height=1)
+                self.canvas.endForm()
+                form = (name, size[0], size[1])
+            except Exception as e:
+                logger.warning("Failed to embed barcode image %s: %s", barcode_path, e)
+        self._barcode_forms[gtin] = form
+        return form
+
+    def _synthesized_form(self, gtin, max_width, max_height):
+        """Form with the bars for gtin drawn as rectangles, in pixel units; (name, width, height) or None."""
+        key = (gtin, max_width, max_height)
+        if key in self._synthesized_forms:
+            return self._synthesized_forms[key]
+
+        form = None
+        geometry = BarcodeSymbol(gtin).geometry(max_width, max_height)
+        if geometry:
+            c = self.canvas
+            name = f'synthesized_barcode_{len(self._synthesized_forms)}'
+            width, height = geometry['width'], geometry['height']
+            c.beginForm(name, lowerx=0, lowery=0, upperx=width, uppery=height)
+            c.setFillColorRGB(0, 0, 0)
+            bar_bottom = height - geometry['bar_height']
+            for x0, x1 in geometry['bars']:
+                c.rect(x0, bar_bottom, x1 - x0, geometry['bar_height'], stroke=0, fill=1)
+
+            font = get_font('regular', geometry['text_size'])
+            font_name = pdf_font_name('regular')
+            text_width = font.getlength(geometry['text'])
+            natural_width = pdfmetrics.stringWidth(geometry['text'], font_name, font.size)
+            text_object = c.beginText((width - text_width) / 2,
+                                      height - geometry['text_y'] - font.getmetrics()[0])
+            text_object.setFont(font_name, font.size)
+            if natural_width:
+                text_object.setHorizScale(100.0 * text_width / natural_width)
+            text_object.textOut(geometry['text'])
+            c.drawText(text_object)
+            c.endForm()
+            form = (name, width, height)
+        self._synthesized_forms[key] = form
+        return form
+
+    def draw(self, label, x, y, width, height):
+        """Draw label into the (x, y, width, height) box, in points from the bottom left."""
+        c = self.canvas
+        layout = LabelLayout(label, dpi=self.dpi)
+        skeleton = layout.skeleton
+        scale = min(width / skeleton.width, height / skeleton.height)
+        top = y + height
+
+        def pt_x(px):
+            return x + px * scale
+
+        def pt_y(py):
+            return top - py * scale
+
+        def text(px, py, value, font, face):
+            if not value:
+                return
+            font_name = pdf_font_name(face)
+            size = font.size * scale
+            # Pillow draws from the ascender line, reportlab from the baseline
+            ascent = font.getmetrics()[0]
+            target_width = font.getlength(value) * scale
+            natural_width = pdfmetrics.stringWidth(value, font_name, size)
+            text_object = c.beginText(pt_x(px), pt_y(py + ascent))
+            text_object.setFont(font_name, size)
+            if natural_width:
+                text_object.setHorizScale(100.0 * target_width / natural_width)
+            text_object.textOut(value)
+            c.drawText(text_object)
+
+        c.saveState()
+        c.setFillColor(self.ink)
+        c.setStrokeColor(self.ink)
+
+        # Border, stroked along the centre of the raster outline
+        inset = skeleton.border_padding_offset + skeleton.border_width / 2
+        outer = skeleton.border_padding_offset - 1 + skeleton.border_width / 2
+        c.setLineWidth(skeleton.border_width * scale)
+        c.rect(pt_x(inset), pt_y(skeleton.height - outer),
+               (skeleton.width - outer - inset) * scale, (skeleton.height - outer - inset) * scale,
+               stroke=1, fill=0)
+
+        # Table
+        for field_label, row_y, value_lines in layout.rows:
+            text(skeleton.x, row_y, field_label, skeleton.font_bold, 'bold')
+            for i, value_line in enumerate(value_lines):
+                text(skeleton.value_column_x, row_y + i * skeleton.line_height,
+                     value_line, skeleton.font_normal, 'regular')
+
+        # Manufacturer info
+        line_y = layout.y_manufacturer
+        text(skeleton.x, line_y, MANUFACTURER_CAPTION, skeleton.font_bold, 'bold')
+        for line in skeleton.manufacturer_lines:
+            line_y += skeleton.line_height
+            text(skeleton.x, line_y, line, skeleton.font_normal, 'regular')
+
+        # Barcode
+        form = self._barcode_form(label.gtin) if label.gtin else None
+        if form:
+            name, barcode_width, barcode_height = form
+            box = layout.barcode_box(barcode_width, barcode_height)
+            if box:
+                box_x, box_y, box_width, box_height = box
+                c.saveState()
+                c.translate(pt_x(box_x), pt_y(box_y + box_height))
+                c.scale(box_width * scale, box_height * scale)
+                c.doForm(name)
+                c.restoreState()
+        elif label.gtin and synthesize_barcodes() and is_valid_gtin(label.gtin):
+            synthesized = self._synthesized_form(label.gtin, *layout.barcode_target_size())
+            if synthesized:
+                name, barcode_width, barcode_height = synthesized
+                box_x, box_y = layout.barcode_position(barcode_width, barcode_height)
+                c.saveState()
+                c.translate(pt_x(box_x), pt_y(box_y + barcode_height))
+                c.scale(scale, scale)
+                c.doForm(name)
+                c.restoreState()
+
+        # "Make in India" footer
+        text(skeleton.x_mii_centered, skeleton.y_mii_start, MAKE_IN_INDIA_TEXT,
+             skeleton.font_make_in_india, 'bold')
+
+        c.restoreState()
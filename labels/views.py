@@ -1,75 +1,247 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, FileResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, FileResponse, JsonResponse, StreamingHttpResponse
 from django.conf import settings
+from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
-from .models import CSVUpload, ProductLabel, BarcodeImage
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from .models import CSVUpload, ProductLabel, LabelJob
 from .forms import CSVUploadForm
-from .utils import process_csv, generate_label_image, create_zip_export, create_pdf_export
+from .utils import filename_part, generate_label_image, stream_zip_export, create_pdf_export
+from .cmyk import print_options
+from .imposition import SHEETS, imposition_from_settings
+from .previews import ensure_preview
+from .bulk_render import ZIP_FORMATS, RenderRequestError, build_label_pdf, request_rows, stream_label_zip
+from .renditions import MAX_DPI, MIN_DPI, NATIVE_DPI, RENDITION_FORMATS, label_rendition
+from .pagination import keyset_page
+from .metrics import EXPORTS, RENDITIONS, registry as metrics_registry, timed
+from .jobs import enqueue_job, latest_job, job_status as get_job_status
+from .export_cache import (
+    build_cached_export, cached_export_response, export_cache_key, export_cache_path,
+    set_validators, tee_to_cache,
+)
+import base64
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
+# Options that change the exported bytes are part of the export cache key: ZIP options
+# come from cmyk.print_options() (profile, intent and compression), PDF ones from the
+# mode and Imposition.options() (sheet, margin, gutter, bleed and crop marks)
+PDF_EXPORT_MODES = ('raster', 'vector')
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
 @login_required
 def upload_csv(request):
-    print("Upload csv called")
     if request.method == 'POST':
-        print("Request method is POST")
-        print("request.POST:", request.POST)
-        print("request.FILES:", request.FILES)
-        print("barcode_images in request.FILES:", 'barcode_images' in request.FILES)
+        logger.debug("Upload POST with files: %s", list(request.FILES))
         form = CSVUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            print("Form is valid")
             csv_upload = form.save()
-            print("Saved CSVUpload:", csv_upload.id)
-            for f in request.FILES.getlist('barcode_images'):
-                print("Saving barcode image:", f.name)
-                BarcodeImage.objects.create(upload=csv_upload, image=f)
-            print("Calling process_csv")
-            process_csv(csv_upload)
+            enqueue_job(csv_upload, LabelJob.PROCESS)
+            logger.info("Upload %s saved, processing job queued", csv_upload.id)
             return redirect('label_list', csv_upload.id)
         else:
-            print("Form is not valid")
-            print("Form errors:", form.errors.as_data())
-            print("Field errors:")
-            for field in form:
-                print(f"{field.name}: {field.errors}")
-            print("Non-field errors:", form.non_field_errors())
+            logger.info("Upload rejected: %s", form.errors.as_json())
     else:
-        print("Request method is not POST")
         form = CSVUploadForm()
     
-    uploads = CSVUpload.objects.all().order_by('-uploaded_at')
+    uploads = keyset_page(
+        with_label_counts(CSVUpload.objects.only('id', 'uploaded_at')),
+        ('-uploaded_at', '-id'), page_size('LABEL_UPLOADS_PAGE_SIZE', 20),
+        after=request.GET.get('after'), before=request.GET.get('before'),
+    )
     return render(request, 'labels/upload.html', {'form': form, 'uploads': uploads})
 
 def label_list(request, upload_id):
-    csv_upload = get_object_or_404(CSVUpload, id=upload_id)
-    labels = csv_upload.labels.all()
+    csv_upload = get_object_or_404(with_label_counts(CSVUpload.objects.only('id', 'row_errors')), id=upload_id)
+    labels = keyset_page(
+        csv_upload.labels.only('id', 'csv_upload', 'row_number', 'product_name', 'product_code', 'mrp', 'copies', 'image', 'preview'),
+        ('row_number', 'id'), page_size('LABEL_LIST_PAGE_SIZE', 48),
+        after=request.GET.get('after'), before=request.GET.get('before'),
+    )
     return render(request, 'labels/label_list.html', {
         'csv_upload': csv_upload,
-        'labels': labels
+        'labels': labels,
+        'job': latest_job(csv_upload),
+        'pdf_sheets': list(SHEETS),
+        'default_sheet': getattr(settings, 'LABEL_PDF_SHEET', 'letter'),
     })
 
+def with_label_counts(uploads):
+    """Annotate uploads with label_count.
+
+    A correlated subquery rather than Count('labels'): the join and GROUP BY
+    would count the labels of every upload before the page is cut, while
+    this counts only the uploads on the page, from the label index.
+    """
+    counts = (
+        ProductLabel.objects.filter(csv_upload=OuterRef('pk')).order_by()
+        .values('csv_upload').annotate(count=Count('*')).values('count')
+    )
+    return uploads.annotate(label_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)))
+
+def page_size(setting, default):
+    return max(1, int(getattr(settings, setting, default)))
+
+def label_preview(request, label_id):
+    """Redirect to a label's preview, making it first for labels rendered before previews existed."""
+    label = get_object_or_404(ProductLabel.objects.only('id', 'image', 'preview'), id=label_id)
+    if not ensure_preview(label):
+        raise Http404('Label has no image yet.')
+    return redirect(label.preview.url)
+
+def render_label(request, label_id):
+    """Serve a label at ?dpi= (72 to 1200, default 300) as ?format= png, webp or tiff, from the rendition cache."""
+    label = get_object_or_404(ProductLabel, id=label_id)
+    fmt = request.GET.get('format', 'png').lower()
+    fmt = 'tiff' if fmt == 'tif' else fmt
+    try:
+        dpi = int(request.GET.get('dpi', NATIVE_DPI))
+    except ValueError:
+        dpi = None
+    if fmt not in RENDITION_FORMATS or dpi is None or not MIN_DPI <= dpi <= MAX_DPI:
+        return HttpResponseBadRequest(
+            f'format must be one of {", ".join(RENDITION_FORMATS)} and dpi a whole number from {MIN_DPI} to {MAX_DPI}.',
+            content_type='text/plain',
+        )
+
+    path, key, cached = label_rendition(label, dpi, fmt)
+    RENDITIONS.inc(format=fmt, cache='hit' if cached else 'miss')
+    response = get_conditional_response(request, etag=quote_etag(key))
+    if response is None:
+        extension, content_type = RENDITION_FORMATS[fmt]
+        # Product codes come from uploaded CSVs, so they're cleaned before going into a header
+        response = FileResponse(open(path, 'rb'), content_type=content_type,
+                                filename=f'label_{filename_part(label.product_code)}_{dpi}dpi.{extension}')
+    return set_validators(response, key)
+
+def job_status(request, upload_id):
+    csv_upload = get_object_or_404(CSVUpload, id=upload_id)
+    return JsonResponse(get_job_status(latest_job(csv_upload)))
+
 def export_zip(request, upload_id):
     csv_upload = get_object_or_404(CSVUpload, id=upload_id)
-    zip_file = create_zip_export(csv_upload)
-    
-    response = FileResponse(open(zip_file, 'rb'), content_type='application/zip')
-    response['Content-Disposition'] = f'attachment; filename="labels_{upload_id}.zip"'
-    return response
+    filename = f'labels_{upload_id}.zip'
+    with timed('export_cache_key'):
+        key = export_cache_key(csv_upload, 'zip', print_options())
+    zip_path = export_cache_path(csv_upload, key, 'zip')
+    if os.path.exists(zip_path):
+        EXPORTS.inc(kind='zip', cache='hit')
+        return cached_export_response(request, zip_path, key, 'application/zip', filename)
+    EXPORTS.inc(kind='zip', cache='miss')
+
+    # Sent while it is being built, so the download starts with the first label.
+    # The stream is also written to the cache for the next download.
+    response = StreamingHttpResponse(
+        tee_to_cache(stream_zip_export(csv_upload), zip_path),
+        content_type='application/zip'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return set_validators(response, key)
 
 def export_pdf(request, upload_id):
     csv_upload = get_object_or_404(CSVUpload, id=upload_id)
-    pdf_file = create_pdf_export(csv_upload)
-    
-    response = FileResponse(open(pdf_file, 'rb'), content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="labels_{upload_id}.pdf"'
+    mode = request.GET.get('mode', 'raster')
+    if mode not in PDF_EXPORT_MODES:
+        mode = 'raster'
+    imposition = imposition_from_settings(request.GET)
+    filename = f'labels_{upload_id}.pdf'
+    with timed('export_cache_key'):
+        key = export_cache_key(csv_upload, 'pdf', dict(imposition.options(), mode=mode), every_label=mode == 'vector')
+    pdf_path = export_cache_path(csv_upload, key, 'pdf')
+    if os.path.exists(pdf_path):
+        EXPORTS.inc(kind=f'pdf_{mode}', cache='hit')
+    else:
+        EXPORTS.inc(kind=f'pdf_{mode}', cache='miss')
+        build_cached_export(pdf_path, lambda path: create_pdf_export(
+            csv_upload, pdf_path=path, mode=mode, imposition=imposition,
+        ))
+    return cached_export_response(request, pdf_path, key, 'application/pdf', filename)
+
+@csrf_exempt
+@require_POST
+def render_api(request):
+    """Render labels for posted rows without saving anything; see labels.bulk_render.
+
+    ?output=zip (default) streams a ZIP of ?format=png (default) or tiff images,
+    ?output=pdf returns a PDF taking ?mode= and the imposition parameters of PDF
+    exports. Callers authenticate with HTTP Basic auth, which browsers don't
+    send to other sites on their own, so those requests need no CSRF token.
+    Callers using a session have to send one, like any form post.
+    """
+    user = basic_auth_user(request)
+    if user is not None and user.is_active:
+        return _render_api_response(request)
+    if request.user.is_authenticated:
+        return csrf_protect(_render_api_response)(request)
+    response = HttpResponse('Login required.', status=401, content_type='text/plain')
+    response['WWW-Authenticate'] = 'Basic realm="labels"'
+    return response
+
+def _render_api_response(request):
+    output = request.GET.get('output', 'zip')
+    fmt = request.GET.get('format', 'png')
+    mode = request.GET.get('mode', 'raster')
+    if output not in ('zip', 'pdf') or fmt not in ZIP_FORMATS or mode not in PDF_EXPORT_MODES:
+        return HttpResponseBadRequest(
+            f'output must be zip or pdf, format one of {", ".join(ZIP_FORMATS)} '
+            f'and mode one of {", ".join(PDF_EXPORT_MODES)}.',
+            content_type='text/plain',
+        )
+    try:
+        rows = request_rows(request)
+    except RenderRequestError as e:
+        return HttpResponseBadRequest(str(e), content_type='text/plain')
+
+    if output == 'pdf':
+        try:
+            pdf, errors = build_label_pdf(rows, imposition_from_settings(request.GET), mode)
+        except RenderRequestError as e:
+            return HttpResponseBadRequest(str(e), content_type='text/plain')
+        response = FileResponse(pdf, content_type='application/pdf', as_attachment=True, filename='labels.pdf')
+        # The PDF has no room for them, so skipped rows are only counted
+        response['X-Skipped-Rows'] = str(len(errors))
+        return response
+    response = StreamingHttpResponse(stream_label_zip(rows, fmt), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="labels.zip"'
     return response
 
 def regenerate_labels(request, upload_id):
     csv_upload = get_object_or_404(CSVUpload, id=upload_id)
-    # Delete old images
-    for label in csv_upload.labels.all():
-        if label.image and os.path.exists(label.image.path):
-            os.remove(label.image.path)
-    # Regenerate
-    process_csv(csv_upload)
+    # The worker runs an incremental repair sync: unchanged labels are kept, and only changed
+    # rows and labels whose files have gone missing are rendered again
+    enqueue_job(csv_upload, LabelJob.REGENERATE)
     return redirect('label_list', upload_id=upload_id)
+
+def metrics(request):
+    """Pipeline counters and timings in Prometheus text format, for staff only.
+
+    Scrapers can authenticate as a staff user with HTTP Basic auth instead of
+    a session.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        user = basic_auth_user(request)
+    if user is None or not user.is_active or not user.is_staff:
+        response = HttpResponse('Staff login required.', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Basic realm="metrics"'
+        return response
+    return HttpResponse(metrics_registry.render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def basic_auth_user(request):
+    """The user an HTTP Basic Authorization header authenticates as, or None."""
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials).decode('utf-8').partition(':')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)